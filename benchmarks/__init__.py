@@ -0,0 +1 @@
+"""Benchmarks of processing events through the falcon app, run with `python -m benchmarks.run --help`"""
@@ -0,0 +1,75 @@
+import json
+import random
+import urllib.parse
+
+from benchmarks.fake_slack import channel_id, user_id
+
+# Share of each kind of event in the corpus
+EVENT_MIX = (('message', 0.7),
+             ('message.file_share', 0.1),
+             ('interactive_message', 0.1),
+             ('reaction_added', 0.1),
+             )
+
+
+def make_corpus(num_events, num_triggers, num_users, num_channels, match_ratio=0.2, seed=0):
+    """Make the bodies of the requests slack would send
+
+    Arguments:
+        num_events {int} -- Number of events to make
+        num_triggers {int} -- Number of commands that were registered, used to make events that trigger them
+        num_users {int} -- Users in the workspace
+        num_channels {int} -- Channels in the workspace
+
+    Keyword Arguments:
+        match_ratio {float} -- Share of the messages that trigger a command, most messages do not (default: {0.2})
+        seed {int} -- Seed for the random choices, so every run gets the same events (default: {0})
+
+    Returns:
+        list -- (event kind, body bytes) for each event
+    """
+    rand = random.Random(seed)
+    kinds = [kind for kind, _ in EVENT_MIX]
+    weights = [weight for _, weight in EVENT_MIX]
+
+    corpus = []
+    for idx in range(num_events):
+        kind = rand.choices(kinds, weights)[0]
+        user = user_id(rand.randrange(num_users))
+        channel = channel_id(rand.randrange(num_channels))
+        event_id = 'Ev{:010d}'.format(idx)
+        ts = '1500000000.{:06d}'.format(idx % 1000000)
+
+        if kind == 'interactive_message':
+            payload = {'type': 'interactive_message',
+                       'callback_id': 'bench_{}'.format(rand.randrange(max(num_triggers, 1))),
+                       'actions': [{'name': 'choice', 'type': 'button', 'value': 'option{}'.format(idx % 5)}],
+                       'action_ts': ts,
+                       'user': {'id': user, 'name': user},
+                       'channel': {'id': channel, 'name': channel},
+                       }
+            body = 'payload=' + urllib.parse.quote(json.dumps(payload))
+            corpus.append((kind, body.encode('utf-8')))
+            continue
+
+        if kind == 'reaction_added':
+            event = {'type': 'reaction_added', 'user': user, 'reaction': rand.choice(('thumbsup', 'eyes', 'tada')),
+                     'item': {'type': 'message', 'channel': channel, 'ts': ts}, 'event_ts': ts}
+
+        elif kind == 'message.file_share':
+            event = {'type': 'message', 'subtype': 'file_share', 'user': user, 'channel': channel, 'ts': ts,
+                     'text': '', 'files': [{'id': 'F{:08d}'.format(idx), 'filetype': rand.choice(('csv', 'png')),
+                                            'name': 'file{}.csv'.format(idx),
+                                            'url_private_download': 'https://files.example.com/{}'.format(idx)}]}
+
+        else:
+            if rand.random() < match_ratio:
+                text = 'cmd{} some arguments {}'.format(rand.randrange(max(num_triggers, 1)), idx)
+            else:
+                text = 'just chatting about thing number {}'.format(idx)
+            event = {'type': 'message', 'user': user, 'channel': channel, 'ts': ts, 'text': text}
+
+        body = {'type': 'event_callback', 'event_id': event_id, 'event_time': 1500000000, 'event': event}
+        corpus.append((kind, json.dumps(body).encode('utf-8')))
+
+    return corpus
@@ -0,0 +1,27 @@
+from slack_actions.testing import StubWebClient
+
+
+def make_web_client(num_users=100, num_channels=10):
+    """Stub of the slack web api with a workspace of `num_users` users and `num_channels` channels
+
+    So the benchmarks only measure slack_actions, not the network
+
+    Returns:
+        StubWebClient -- The stub, used as the `web_client` of the setup
+    """
+    users = [{'id': user_id(idx), 'name': 'user{}'.format(idx), 'real_name': 'User {}'.format(idx),
+              'team_id': 'T0', 'tz': 'America/New_York', 'deleted': False, 'is_bot': False,
+              'profile': {'email': 'user{}@example.com'.format(idx), 'image_72': 'https://example.com/a.png'}}
+             for idx in range(num_users)]
+    channels = [{'id': channel_id(idx), 'name': 'channel{}'.format(idx), 'is_channel': True,
+                 'is_member': True, 'is_private': False, 'num_members': 10}
+                for idx in range(num_channels)]
+    return StubWebClient(users=users, channels=channels, make_up_missing=False, bot_user_id='UBOT')
+
+
+def user_id(idx):
+    return 'U{:08d}'.format(idx)
+
+
+def channel_id(idx):
+    return 'C{:08d}'.format(idx)
@@ -0,0 +1,229 @@
+"""Benchmark processing events through the falcon app
+
+Each combination of the sweep runs in its own process, so the results (and peak memory) of one do not affect another.
+The slack web api is replaced by `slack_actions.testing.StubWebClient`, so only the time spent in slack_actions is
+measured.
+
+    python -m benchmarks.run --triggers 10,100 --channels 1,50 --users 100,10000 --output results.json
+    python -m benchmarks.run --compare before.json after.json
+"""
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import itertools
+import subprocess
+
+# Compared between runs by `--compare`, True if a bigger number is better
+COMPARE_FIELDS = (('events_per_sec', True),
+                  ('p50_ms', False),
+                  ('p99_ms', False),
+                  ('peak_rss_kb', False),
+                  )
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+
+    return sorted_values[min(len(sorted_values) - 1, int(round(percent / 100 * (len(sorted_values) - 1))))]
+
+
+def register_commands(slack_controller, num_triggers, num_channels):
+    """Register `num_triggers` commands and spread them over the channels
+
+    A few commands are in `__all__`, the rest are each only in one channel
+    """
+    commands = []
+    for idx in range(num_triggers):
+        def command(output, full_event, idx=idx):
+            return {'text': 'cmd{} got {}'.format(idx, output)}
+
+        command.__name__ = command.__qualname__ = 'cmd{}'.format(idx)
+        slack_controller.trigger(['message'], {'text': '^cmd{} (.+)'.format(idx)})(command)
+        slack_controller.trigger('interactive_message', {'callback_id': '^bench_{}$'.format(idx),
+                                                         'actions.value': '(.*)'})(command)
+        if idx < 2:
+            slack_controller.trigger(['message.file_share'], {'files.filetype': 'csv'})(command)
+            slack_controller.trigger(['reaction_added'], {'reaction': '^tada$'})(command)
+
+        commands.append(command)
+
+    channel_commands = {'__all__': commands[:min(10, num_triggers)]}
+    for idx, command in enumerate(commands[10:]):
+        channel_commands.setdefault('channel{}'.format(idx % num_channels), []).append(command)
+
+    slack_controller.add_commands(channel_commands)
+
+
+def run_single(config):
+    """Run one combination of the sweep in this process
+
+    Arguments:
+        config {dict} -- `events`, `triggers`, `channels` and `users`
+
+    Returns:
+        dict -- The config and its results
+    """
+    import resource
+    import falcon.testing
+    from slack_actions import slack_controller, app
+    from benchmarks.corpus import make_corpus
+    from benchmarks.fake_slack import make_web_client
+
+    logging.disable(logging.WARNING)
+
+    web_client = make_web_client(num_users=config['users'], num_channels=config['channels'])
+    setup_start = time.perf_counter()
+    slack_controller.setup(slack_bot_token='xoxb-benchmark', web_client=web_client, metrics=config['metrics'])
+    register_commands(slack_controller, config['triggers'], config['channels'])
+    setup_seconds = time.perf_counter() - setup_start
+
+    corpus = make_corpus(config['events'] + config['warmup'], config['triggers'], config['users'],
+                         config['channels'], seed=config['seed'])
+
+    def start_response(status, headers, exc_info=None):
+        if not status.startswith('200'):
+            raise RuntimeError("Got a {} from the app".format(status))
+
+    environs = [(kind, falcon.testing.create_environ(path='/slack/event', method='POST', body=body))
+                for kind, body in corpus]
+
+    for _, environ in environs[:config['warmup']]:
+        b''.join(app(environ, start_response))
+
+    latencies = []
+    kind_latencies = {}
+    api_calls_start = web_client.total_calls
+    run_start = time.perf_counter()
+    for kind, environ in environs[config['warmup']:]:
+        start = time.perf_counter()
+        b''.join(app(environ, start_response))
+        latency = time.perf_counter() - start
+        latencies.append(latency)
+        kind_latencies.setdefault(kind, []).append(latency)
+    run_seconds = time.perf_counter() - run_start
+
+    latencies.sort()
+    by_kind = {}
+    for kind, values in kind_latencies.items():
+        values.sort()
+        by_kind[kind] = {'events': len(values),
+                         'p50_ms': percentile(values, 50) * 1000,
+                         'p99_ms': percentile(values, 99) * 1000,
+                         }
+
+    return dict(config,
+                setup_seconds=setup_seconds,
+                seconds=run_seconds,
+                events_per_sec=len(latencies) / run_seconds,
+                p50_ms=percentile(latencies, 50) * 1000,
+                p99_ms=percentile(latencies, 99) * 1000,
+                max_ms=latencies[-1] * 1000,
+                # Kilobytes on linux
+                peak_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                api_calls=web_client.total_calls - api_calls_start,
+                by_kind=by_kind,
+                )
+
+
+def run_sweep(args):
+    results = []
+    for num_triggers, num_channels, num_users in itertools.product(args.triggers, args.channels, args.users):
+        config = {'events': args.events,
+                  'warmup': args.warmup,
+                  'triggers': num_triggers,
+                  'channels': num_channels,
+                  'users': num_users,
+                  'metrics': args.metrics,
+                  'seed': args.seed,
+                  }
+        # A new process for each one so they all start from nothing
+        command = [sys.executable, '-W', 'ignore', '-m', 'benchmarks.run', '--single', json.dumps(config)]
+        proc = subprocess.run(command, stdout=subprocess.PIPE, check=True)
+        result = json.loads(proc.stdout.decode('utf-8').strip().splitlines()[-1])
+        print("triggers={triggers} channels={channels} users={users}: {events_per_sec:.0f} events/s "
+              "p50={p50_ms:.3f}ms p99={p99_ms:.3f}ms rss={peak_rss_kb}KB".format(**result), file=sys.stderr)
+        results.append(result)
+
+    return {'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'created_at': time.time(),
+            'results': results,
+            }
+
+
+def git_commit():
+    try:
+        proc = subprocess.run(['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return proc.stdout.decode('utf-8').strip()
+
+
+def compare(before_path, after_path):
+    """Print how each result changed between two runs, matched by their config"""
+    with open(before_path) as before_file, open(after_path) as after_file:
+        before, after = json.load(before_file), json.load(after_file)
+
+    def key(result):
+        return (result['triggers'], result['channels'], result['users'])
+
+    before_results = {key(result): result for result in before['results']}
+    print("{} -> {}".format(before.get('commit'), after.get('commit')))
+    for result in after['results']:
+        old = before_results.get(key(result))
+        if old is None:
+            continue
+
+        changes = []
+        for field, bigger_is_better in COMPARE_FIELDS:
+            change = (result[field] - old[field]) / old[field] * 100 if old[field] else 0
+            better = (change > 0) == bigger_is_better
+            flag = '' if abs(change) < 1 or better else ' !'
+            changes.append("{}: {:.3f} -> {:.3f} ({:+.1f}%{})".format(field, old[field], result[field], change, flag))
+        print("triggers={} channels={} users={}  ".format(*key(result)) + '  '.join(changes))
+
+
+def int_list(value):
+    return [int(item) for item in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=5000, help="Events to time in each run")
+    parser.add_argument('--warmup', type=int, default=500, help="Events sent before timing starts")
+    parser.add_argument('--triggers', type=int_list, default=[10, 100, 1000], help="Number of commands, comma "
+                                                                                   "separated")
+    parser.add_argument('--channels', type=int_list, default=[1, 100], help="Number of channels, comma separated")
+    parser.add_argument('--users', type=int_list, default=[100, 10000], help="Number of users, comma separated")
+    parser.add_argument('--metrics', action='store_true', help="Turn on the metrics while running")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the results as json to this file instead of stdout")
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help="Compare two results files")
+    parser.add_argument('--single', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single(json.loads(args.single))))
+        return
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    output = json.dumps(run_sweep(args), indent=2)
+    if args.output:
+        with open(args.output, 'w') as out_file:
+            out_file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,8 +11,9 @@ class CommandClass:
                                                        color="#7575a3",
                                                        text="Type:\n> fooA")(self.message_a)
 
-        self.upload_csv = slack_controller.trigger(['message.file_share'],
-                                                   {'files.filetype': "csv"})(self.upload_csv)
+        # Reading the csv is cpu heavy, so it runs in a worker process instead of holding up the other events
+        self.upload_csv = slack_controller.trigger(['message.file_share'], {'files.filetype': "csv"},
+                                                   execution={'executor': 'process'})(self.upload_csv)
         self.upload_csv = slack_controller.help_message(author_name="trigger:file upload",
                                                         color="#ff4000",
                                                         text="upload a csv file")(self.upload_csv)
@@ -31,9 +32,8 @@ class CommandClass:
         return message_data
 
     def upload_csv(self, output, full_event):
-        link = full_event['event']['files'][0]['url_private_download']
-        file_id = full_event['event']['files'][0]['id']
-        file_ = slack_controller.download(link, f'/tmp/{file_id}.csv')
+        file_info = full_event['event']['files'][0]
+        file_ = slack_controller.download_file(file_info, f"/tmp/{file_info['id']}.csv")
         message_data = {'text': 'fn: upload_csv. Downloaded to the server at {}'.format(file_),
                         # Respond in the thread if thats where the file was uploaded to
                         'thread_ts': full_event['event'].get('thread_ts'),
@@ -29,7 +29,7 @@ slack_controller.setup()
 #                     'name': 'thumbsup',
 #                     'timestamp': full_data['event']['event_ts']
 #                     }
-#     slack_response = slack_controller.slack_client.api_call(**message_data)
+#     slack_response = slack_controller.api_call(**message_data)
 #     if slack_response['ok'] is False:
 #         error_message = "Failed to add help reaction. Slack Web API Response: {error} {content}"\
 #                         .format(error=slack_response['error'],
@@ -83,7 +83,7 @@ class UIElements:
                         'channel': full_event['sa_channel']['id'],
                         'text': f"thanks for playing {output['actions.selected_options.value'][0]}!",
                         'attachments': []}
-        slack_controller.slack_client.api_call(**message_data)
+        slack_controller.api_call(**message_data)
 
         user = f"<@{full_event['sa_user']['id']}>"
         return {'text': f'I updated the message above with your answer {user}'}
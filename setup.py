@@ -23,6 +23,13 @@ setup(
     ],
     install_requires=['slackclient',
                       'falcon',
+                      'requests',
                       'gunicorn',
                       ],
+    extras_require={'async': ['aiohttp',
+                              'falcon>=3',
+                              ],
+                    'socket_mode': ['websocket-client',
+                                    ],
+                    },
 )
@@ -1,43 +1,125 @@
 import json
+import time
 import falcon
 import logging
 import urllib.parse
+from slack_actions.lazy_event import LazyEvent
 from slack_actions.slack_controller import slack_controller
 
 
 logger = logging.getLogger(__name__)
 
+# Events used to keep the users and channels up to date
+DIRECTORY_EVENT_TYPES = ['user_change', 'team_join', 'channel_created', 'channel_rename', 'channel_deleted',
+                         'member_joined_channel']
+
 
 class Event(object):
     def on_post(self, req, resp):
         """Handles POST requests sent from the slack events"""
         resp.status = falcon.HTTP_200
-        stream = req.stream.read().decode('utf-8')
+        body = req.stream.read()
+        if slack_controller.capture is not None:
+            slack_controller.capture.record(body, req.headers)
+
+        with slack_controller.metrics.timer('decode'):
+            event = self.parse_body(body)
+
+        if self.respond_early(event, req, resp):
+            return
+
+        if slack_controller.event_queue is not None:
+            # Let slack know we got the event and do the work after responding
+            if slack_controller.event_queue.submit(self.handle_event, event):
+                return
+            logger.warning("Event queue is full, processing the event before responding")
+
+        self.handle_event(event)
+
+    def parse_body(self, body):
+        """Parse the body of the request, slack sends events as json and interactive messages as a url encoded form
+
+        Arguments:
+            body {bytes} -- The raw body of the request
+
+        Returns:
+            LazyEvent -- The event sent by slack
+        """
+        stream = body.decode('utf-8')
         try:
             event = json.loads(stream)
         except json.decoder.JSONDecodeError:
             event = json.loads(urllib.parse.unquote(stream).replace('payload=', ''))
 
+        return LazyEvent(event)
+
+    def respond_early(self, event, req, resp):
+        """Check if the request can be responded to without processing the event
+
+        Arguments:
+            event {dict} -- The parsed event sent by slack
+            req {falcon.Request} -- The request
+            resp {falcon.Response} -- The response
+
+        Returns:
+            bool -- True if there is nothing else to do
+        """
         if event.get('type') == 'url_verification':
             # Used when adding the url to the App config in slack
             resp.media = {'challenge': event['challenge']}
+            return True
+
+        if slack_controller.deduplicator is not None:
+            # Slack resends events it did not get a response for in time, do not process them twice
+            if not slack_controller.deduplicator.check(event,
+                                                       retry_num=req.get_header('X-Slack-Retry-Num'),
+                                                       retry_reason=req.get_header('X-Slack-Retry-Reason')):
+                return True
+
+        return False
+
+    def handle_event(self, event):
+        """Enrich the event and run the help message or any commands it triggers
+
+        Arguments:
+            event {dict} -- The parsed event sent by slack
+        """
+        metrics = slack_controller.metrics
+        start_time = time.perf_counter()
+        event_type = self.enrich_event(event)
+        if event_type is None:
+            metrics.incr('events_skipped')
             return
 
-        # Add user and channel data expanded out
-        event.update({'sa_user': None,  # All the user info pulled from the slack api of the uer who triggered the event
-                      'sa_channel': None,  # The channel/dm info from the slack api on wher the event happened
-                      })
+        metrics.incr('events', event_type=event_type)
+        metrics.observe('enrich', time.perf_counter() - start_time, event_type=event_type)
 
-        # 1. Get the user, channel, and file (if needed) from the event
-        try:
-            if ((event.get('type') == 'interactive_message' and event['user']['id'] == slack_controller.BOT_ID) or
-                    event.get('event', {}).get('bot_id') == slack_controller.BOT_ID or
-                    event.get('event', {}).get('user') == slack_controller.BOT_USER_ID):
-                # Do not let the bot interact with itself, but still allow other bots to trigger it
+        # 2 - Check if its the help message, if so do nothing else
+        with metrics.timer('help_check', event_type=event_type):
+            if slack_controller.help_check(event, event_type):
                 return
 
-            logger.debug({"original_slack_event": event})
+        # 3. Check the commands that are listening to see which needs to be triggered
+        with metrics.timer('process_event', event_type=event_type):
+            slack_controller.process_event(event, event_type)
+
+    def enrich_event(self, event):
+        """Add the user and channel data to the event
+
+        `sa_user` (all the user info pulled from the slack api of the user who triggered the event) and
+        `sa_channel` (the channel/dm info from the slack api on where the event happened) are only looked up
+        the first time they are used
 
+        Arguments:
+            event {LazyEvent} -- The parsed event sent by slack
+
+        Returns:
+            str/None -- The event type, None if the event should not be processed
+        """
+        event_type = None
+
+        # 1. Get the user, channel, and file (if needed) from the event
+        try:
             try:
                 # Get the event type
                 event_type = event['event']['type']
@@ -47,45 +129,85 @@ class Event(object):
                 # Prob some interactive or something else
                 event_type = event['type']
 
+            if event_type in DIRECTORY_EVENT_TYPES:
+                # Done before the bot check below so the bot joining a channel is also seen
+                slack_controller.update_directory(event, event_type)
+
+            if ((event.get('type') == 'interactive_message' and event['user']['id'] == slack_controller.BOT_ID) or
+                    event.get('event', {}).get('bot_id') == slack_controller.BOT_ID or
+                    event.get('event', {}).get('user') == slack_controller.BOT_USER_ID):
+                # Do not let the bot interact with itself, but still allow other bots to trigger it
+                return None
+
+            if (not slack_controller.has_triggers(event_type) and
+                    not slack_controller.is_help_message(event, event_type)):
+                # Nothing would be done with it, so do not bother looking anything up
+                return None
+
+            logger.debug({"original_slack_event": event})
+
             # Add more event types as needed to get the correct information
             if event_type in ['file_shared', 'file_created']:
                 # Really should use message.file_share instead since it has all the file info already in it
-                event['sa_user'] = slack_controller.get_user(event['event']['user_id'])
-                # Need this for the channel id
-                file_data = slack_controller.slack_client.api_call('files.info', file=event['event']['file_id'])
-                event['sa_channel'] = slack_controller.get_channel(file_data['file']['channels'][0])
+                # The user does not depend on the file, so start looking it up now in case it is used
+                event.lazy('sa_user', slack_controller.get_user_future(event['event']['user_id']).result)
+                event.lazy('sa_channel', lambda: slack_controller.get_channel(self._get_file_channel_id(event)))
+
+            elif event_type in ['user_change', 'team_join']:
+                event.lazy('sa_user', lambda: slack_controller.get_user(event['event']['user']['id']))
+
+            elif event_type in ['channel_created', 'channel_rename']:
+                event.lazy('sa_channel', lambda: slack_controller.get_channel(event['event']['channel']['id']))
+
+            elif event_type in ['channel_deleted']:
+                # Channel no longer exists
+                pass
 
             elif event_type in ['interactive_message', 'dialog_submission']:
-                event['sa_user'] = slack_controller.get_user(event['user']['id'])
-                event['sa_channel'] = slack_controller.get_channel(event['channel']['id'])
+                event.lazy('sa_user', lambda: slack_controller.get_user(event['user']['id']))
+                event.lazy('sa_channel', lambda: slack_controller.get_channel(event['channel']['id']))
 
             elif event_type in ['message.message_changed']:
-                event['sa_user'] = slack_controller.get_user(event['event']['message']['user'])
-                event['sa_channel'] = slack_controller.get_channel(event['event']['channel'])
+                event.lazy('sa_user', lambda: slack_controller.get_user(event['event']['message']['user']))
+                event.lazy('sa_channel', lambda: slack_controller.get_channel(event['event']['channel']))
 
             elif event_type in ['message.message_deleted']:
-                event['sa_user'] = slack_controller.get_user(event['event']['previous_message']['user'])
-                event['sa_channel'] = slack_controller.get_channel(event['event']['channel'])
+                event.lazy('sa_user', lambda: slack_controller.get_user(event['event']['previous_message']['user']))
+                event.lazy('sa_channel', lambda: slack_controller.get_channel(event['event']['channel']))
 
             elif event_type in ['reaction_added']:
-                event['sa_user'] = slack_controller.get_user(event['event']['user'])
-                event['sa_channel'] = slack_controller.get_channel(event['event']['item']['channel'])
+                event.lazy('sa_user', lambda: slack_controller.get_user(event['event']['user']))
+                event.lazy('sa_channel', lambda: slack_controller.get_channel(event['event']['item']['channel']))
 
             else:
-                event['sa_user'] = slack_controller.get_user(event['event']['user'])
-                event['sa_channel'] = slack_controller.get_channel(event['event']['channel'])
+                event.lazy('sa_user', lambda: slack_controller.get_user(event['event']['user']))
+                event.lazy('sa_channel', lambda: slack_controller.get_channel(event['event']['channel']))
 
         except Exception:
             logger.exception("Broke generating `event`")
 
         logger.debug({"full_event": event})
 
-        # 2 - Check if its the help message, if so do nothing else
-        if slack_controller.help_check(event, event_type):
-            return
+        return event_type
 
-        # 3. Check the commands that are listening to see which needs to be triggered
-        slack_controller.process_event(event, event_type)
+    def _get_file_channel_id(self, event):
+        channel_id = event['event'].get('channel_id')
+        if channel_id is None:
+            # Need this for the channel id
+            channel_id = slack_controller.get_file_info(event['event']['file_id'])['channels'][0]
+
+        return channel_id
+
+
+class PrometheusMetrics(object):
+    def on_get(self, req, resp):
+        """The metrics in the prometheus text format, only if `metrics=True` was passed to the setup"""
+        body = slack_controller.metrics.render_prometheus()
+        if body is None:
+            raise falcon.HTTPNotFound()
+
+        resp.content_type = 'text/plain; version=0.0.4'
+        resp.data = body.encode('utf-8')
 
 
 app = falcon.API()
@@ -93,3 +215,4 @@ app = falcon.API()
 event = Event()
 # Everything gets posted to this single endpoint
 app.add_route('/slack/event', event)
+app.add_route('/slack/metrics', PrometheusMetrics())
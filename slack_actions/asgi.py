@@ -0,0 +1,84 @@
+import time
+import asyncio
+import falcon
+import falcon.asgi
+import logging
+from slack_actions.api import Event, PrometheusMetrics
+from slack_actions.slack_controller import slack_controller
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncEvent(Event):
+    """Same as `api.Event`, but for an asgi server
+
+    `async def` callbacks are awaited and all others are run in the event loop's executor,
+    the response to slack is sent without blocking
+    """
+
+    async def on_post(self, req, resp):
+        """Handles POST requests sent from the slack events"""
+        resp.status = falcon.HTTP_200
+        body = await req.stream.read()
+        if slack_controller.capture is not None:
+            slack_controller.capture.record(body, req.headers)
+
+        with slack_controller.metrics.timer('decode'):
+            event = self.parse_body(body)
+
+        if self.respond_early(event, req, resp):
+            return
+
+        await self.handle_event(event)
+
+    async def handle_event(self, event):
+        """Enrich the event and run the help message or any commands it triggers
+
+        Arguments:
+            event {dict} -- The parsed event sent by slack
+        """
+        metrics = slack_controller.metrics
+        loop = asyncio.get_running_loop()
+        start_time = time.perf_counter()
+        # Getting the user and channel may need to call the slack api
+        event_type = await loop.run_in_executor(None, self.enrich_event, event)
+        if event_type is None:
+            metrics.incr('events_skipped')
+            return
+
+        # Look up the user and channel now, so using them does not block the event loop
+        await loop.run_in_executor(None, event.resolve_all)
+        metrics.incr('events', event_type=event_type)
+        metrics.observe('enrich', time.perf_counter() - start_time, event_type=event_type)
+
+        # 2 - Check if its the help message, if so do nothing else
+        with metrics.timer('help_check', event_type=event_type):
+            if await loop.run_in_executor(None, slack_controller.help_check, event, event_type):
+                return
+
+        # 3. Check the commands that are listening to see which needs to be triggered
+        with metrics.timer('process_event', event_type=event_type):
+            await slack_controller.process_event_async(event, event_type)
+
+
+class AsyncPrometheusMetrics(PrometheusMetrics):
+
+    async def on_get(self, req, resp):
+        super().on_get(req, resp)
+
+
+class CloseSlackClient:
+    """Closes the connections to the slack api when the server shuts down"""
+
+    async def process_shutdown(self, scope, event):
+        if slack_controller.async_client is not None:
+            await slack_controller.async_client.close()
+
+
+app = falcon.asgi.App(middleware=[CloseSlackClient()])
+
+event = AsyncEvent()
+# Everything gets posted to this single endpoint
+app.add_route('/slack/event', event)
+app.add_route('/slack/metrics', AsyncPrometheusMetrics())
@@ -0,0 +1,86 @@
+import time
+import logging
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+from slack_actions.web_client import RateLimits, encode_api_data
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncSlackClient:
+    """Calls the slack web api using aiohttp so it does not block the event loop
+
+    A single session is used so connections are kept alive between calls. Calls are delayed by the same token
+    buckets as `SlackWebClient`, and retried after the `Retry-After` time when slack responds with a 429
+    """
+
+    def __init__(self, token, base_url='https://slack.com/api/', max_retries=5, rate_limits=None):
+        """
+        Arguments:
+            token {str} -- The slack bot token
+
+        Keyword Arguments:
+            base_url {str} -- Url of the slack web api, can be changed to point to a test server
+                              (default: {'https://slack.com/api/'})
+            max_retries {int} -- Max number of times to retry a call that was rate limited (default: {5})
+            rate_limits {RateLimits} -- Share the rate limits of a `SlackWebClient` (its `rate_limits`), so the calls
+                                        of both count against the same limits (default: {None})
+        """
+        if aiohttp is None:
+            raise ImportError("aiohttp is needed to use the asgi app, "
+                              "install it with `pip install slack_actions[async]`")
+
+        self.token = token
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.rate_limits = rate_limits if rate_limits is not None else RateLimits()
+        self._session = None
+
+    async def api_call(self, method, **kwargs):
+        """Call a slack web api method
+
+        Arguments:
+            method {str} -- The slack api method, like `chat.postMessage`
+
+        Returns:
+            dict -- The response from the slack api
+        """
+        if self._session is None or self._session.closed:
+            # Needs to be created inside of the running event loop
+            self._session = aiohttp.ClientSession(headers={'Authorization': 'Bearer {}'.format(self.token)})
+
+        data = encode_api_data(kwargs)
+        bucket = self.rate_limits.get_bucket(method, kwargs)
+        throttled_seconds = 0
+        start_time = time.monotonic()
+        slack_response = {'ok': False, 'error': 'http_429'}  # If it is rate limited every time
+        for _ in range(self.max_retries + 1):
+            throttled_seconds += await bucket.acquire_async()
+            async with self._session.post(self.base_url + method, data=data) as response:
+                if response.status != 429:
+                    try:
+                        slack_response = await response.json(content_type=None)
+                    except ValueError:
+                        slack_response = {'ok': False, 'error': 'http_{}'.format(response.status)}
+                    break
+
+                self.rate_limits.rate_limited(method, bucket, response.headers)
+
+        elapsed = time.monotonic() - start_time
+        self.rate_limits.record(method, calls=1, errors=0 if slack_response.get('ok') else 1,
+                                throttled_seconds=throttled_seconds, elapsed=elapsed)
+        return slack_response
+
+    def stats(self):
+        """Same as `SlackWebClient.stats`"""
+        return self.rate_limits.stats()
+
+    async def close(self):
+        """Close the session and all of its connections"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
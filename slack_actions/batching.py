@@ -0,0 +1,111 @@
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# What can be passed in a trigger's `batch` option
+BATCH_OPTIONS = {'max_size', 'max_wait'}
+
+
+class EventBatcher:
+    """Buffers the events that matched a batched trigger and hands them over as a list
+
+    A buffer is flushed once it has `max_size` events, or `max_wait` seconds after its first event. All flushes happen
+    in a background thread, never in the thread that added the event (it can be the event loop of the asgi app)
+    """
+
+    def __init__(self, flush):
+        """
+        Arguments:
+            flush {function} -- Called with the key and the list of items of each buffer when it is full or too old
+        """
+        self._flush = flush
+        self._buffers = {}  # key -> [flush at, items]
+        self._full = []  # (key, items) of the buffers that reached their max_size, flushed next
+        self._cond = threading.Condition()
+        self._thread = None
+
+    @staticmethod
+    def check_options(options):
+        """Make sure the `batch` option of a trigger is valid
+
+        Arguments:
+            options {dict} -- The batch options
+
+        Raises:
+            ValueError -- If it has an unknown key or a size less then 1
+        """
+        unknown = set(options) - BATCH_OPTIONS
+        if unknown:
+            raise ValueError("Unknown batch options {}, must be from {}".format(sorted(unknown), sorted(BATCH_OPTIONS)))
+        if options.get('max_size', 1) < 1:
+            raise ValueError("batch max_size must be at least 1")
+
+    def add(self, key, item, max_size=100, max_wait=1.0):
+        """Add an item to the buffer of the key
+
+        Arguments:
+            key -- What to buffer the items by, like the callback
+            item -- The item to add
+
+        Keyword Arguments:
+            max_size {int} -- Flush once the buffer has this many items (default: {100})
+            max_wait {float} -- Flush this many seconds after the first item was added (default: {1.0})
+        """
+        with self._cond:
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                buffer = self._buffers[key] = [time.monotonic() + max_wait, []]
+                self._start()
+                # The background thread may need to wake up sooner
+                self._cond.notify()
+
+            buffer[1].append(item)
+            if len(buffer[1]) >= max_size:
+                del self._buffers[key]
+                self._full.append((key, buffer[1]))
+                self._cond.notify()
+
+    def flush_all(self):
+        """Flush every buffer now, like before shutting down"""
+        with self._cond:
+            batches = self._full + [(key, items) for key, (_, items) in self._buffers.items()]
+            self._buffers = {}
+            self._full = []
+
+        for key, items in batches:
+            self._run_flush(key, items)
+
+    def pending(self):
+        """Number of items waiting to be flushed"""
+        with self._cond:
+            return (sum(len(items) for _, items in self._buffers.values())
+                    + sum(len(items) for _, items in self._full))
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._flush_loop, name='slack-actions-batcher', daemon=True)
+            self._thread.start()
+
+    def _run_flush(self, key, items):
+        try:
+            self._flush(key, items)
+        except Exception:
+            logger.exception("Broke flushing a batch of {} items".format(len(items)))
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                due = [key for key, (flush_at, _) in self._buffers.items() if flush_at <= now]
+                if not due and not self._full:
+                    next_flush_at = min((flush_at for flush_at, _ in self._buffers.values()), default=None)
+                    self._cond.wait(None if next_flush_at is None else next_flush_at - now)
+                    continue
+
+                batches = self._full + [(key, self._buffers.pop(key)[1]) for key in due]
+                self._full = []
+
+            for key, items in batches:
+                self._run_flush(key, items)
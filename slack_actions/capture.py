@@ -0,0 +1,168 @@
+import os
+import gzip
+import json
+import time
+import queue
+import base64
+import logging
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Windows, only the threads of a single process can share a capture
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class TrafficCapture:
+    """Appends the requests slack sends to a gzip compressed log, so real traffic can be replayed later
+
+    Each line is a json object with the time it was received, the headers and the raw body (base64).
+    Requests are written by a background thread in batches, each batch is a complete gzip member so a crash never
+    leaves a broken file. When the file is bigger then `max_bytes` it is rotated like `logging.RotatingFileHandler`:
+    `capture.log.gz` -> `capture.log.gz.1` -> ... -> `capture.log.gz.<backup_count>`
+
+    Several processes (like the gunicorn workers) can capture to the same path, each write and rotate is done while
+    holding a lock on `<path>.lock` so none of them write to a file that is being rotated
+    """
+
+    def __init__(self, path, max_bytes=100 * 1024 ** 2, backup_count=5, max_queue=10000):
+        """
+        Arguments:
+            path {str} -- Path of the log file
+
+        Keyword Arguments:
+            max_bytes {int} -- Rotate the file once it is this big (default: {100MB})
+            backup_count {int} -- Number of rotated files to keep (default: {5})
+            max_queue {int} -- Max number of requests waiting to be written, more are dropped (default: {10000})
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.dropped = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._writer = threading.Thread(target=self._write_loop, name='slack-actions-capture', daemon=True)
+        self._writer.start()
+
+    def record(self, body, headers):
+        """Add a request to the log, does not wait for it to be written
+
+        Arguments:
+            body {bytes} -- The raw body of the request
+            headers {dict} -- The headers of the request
+        """
+        try:
+            self._queue.put_nowait((time.time(), dict(headers), body))
+        except queue.Full:
+            # Never slow down the response to slack because of the capture
+            self.dropped += 1
+
+    def flush(self):
+        """Wait until everything recorded so far is written"""
+        self._queue.join()
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._write(batch)
+            except Exception:
+                logger.exception("Failed to write {} requests to the capture {}".format(len(batch), self.path))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        lines = []
+        for received_at, headers, body in batch:
+            lines.append(json.dumps({'t': received_at,
+                                     'headers': headers,
+                                     'body': base64.b64encode(body).decode('ascii'),
+                                     }, separators=(',', ':')))
+
+        data = gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'))
+        with self._file_lock():
+            with open(self.path, 'ab') as log_file:
+                log_file.write(data)
+
+            if os.path.getsize(self.path) >= self.max_bytes:
+                self._rotate()
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        """Lock the capture against the other processes writing to it"""
+        if fcntl is None:
+            yield
+            return
+
+        with open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _rotate(self):
+        if self.backup_count <= 0:
+            os.remove(self.path)
+            return
+
+        for idx in range(self.backup_count - 1, 0, -1):
+            src = '{}.{}'.format(self.path, idx)
+            if os.path.exists(src):
+                os.replace(src, '{}.{}'.format(self.path, idx + 1))
+
+        os.replace(self.path, self.path + '.1')
+
+
+def capture_files(path):
+    """All the files of a capture, oldest first
+
+    Arguments:
+        path {str} -- Path of the log file, the rotated files next to it are included
+
+    Returns:
+        list -- The paths
+    """
+    paths = []
+    idx = 1
+    while os.path.exists('{}.{}'.format(path, idx)):
+        paths.append('{}.{}'.format(path, idx))
+        idx += 1
+
+    paths.reverse()
+    if os.path.exists(path):
+        paths.append(path)
+
+    return paths
+
+
+def read_capture(path):
+    """Read the requests from a capture, oldest first
+
+    Arguments:
+        path {str} -- Path of the log file, the rotated files next to it are included
+
+    Yields:
+        tuple -- (time it was received, headers dict, body bytes)
+    """
+    for file_path in capture_files(path):
+        with gzip.open(file_path, 'rb') as log_file:
+            try:
+                for line in log_file:
+                    record = json.loads(line)
+                    yield record['t'], record['headers'], base64.b64decode(record['body'])
+            except (EOFError, gzip.BadGzipFile):
+                # The last write was cut off
+                logger.warning("Capture {} ends early".format(file_path))
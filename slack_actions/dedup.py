@@ -0,0 +1,116 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class EventDeduplicator:
+    """Remembers the events that have been seen so retries sent by slack are not processed twice
+
+    Slack will resend an event (with the `X-Slack-Retry-Num` header) if it did not get a response in time,
+    even if the first delivery is still being processed.
+    """
+
+    def __init__(self, ttl=600, max_size=10000):
+        """
+        Keyword Arguments:
+            ttl {int} -- Seconds to remember an event for. Slack retries for up to ~5 minutes (default: {600})
+            max_size {int} -- Max number of events to remember, the oldest are forgotten first (default: {10000})
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self._seen = OrderedDict()  # key -> time it was first seen
+        self._lock = threading.Lock()
+
+        self.hits = 0  # Duplicates that were not processed again
+        self.misses = 0  # New events
+        self.retries = 0  # Deliveries slack flagged as a retry
+
+    @staticmethod
+    def event_key(event):
+        """Get the key that is unique for each event slack sends
+
+        Arguments:
+            event {dict} -- The parsed event sent by slack
+
+        Returns:
+            str/None -- The key, or None if the event has nothing to uniquely identify it
+        """
+        if event.get('event_id'):
+            return 'event_id:' + event['event_id']
+
+        # Interactive payloads
+        try:
+            return 'action_ts:' + event['actions'][0]['action_ts']
+        except (KeyError, IndexError, TypeError):
+            pass
+
+        if event.get('trigger_id'):
+            return 'trigger_id:' + event['trigger_id']
+
+        if event.get('action_ts'):
+            return 'action_ts:' + event['action_ts']
+
+        return None
+
+    def check(self, event, retry_num=None, retry_reason=None):
+        """Check if the event should be processed, and remember it if so
+
+        Arguments:
+            event {dict} -- The parsed event sent by slack
+
+        Keyword Arguments:
+            retry_num {str} -- Value of the `X-Slack-Retry-Num` header (default: {None})
+            retry_reason {str} -- Value of the `X-Slack-Retry-Reason` header (default: {None})
+
+        Returns:
+            bool -- True if the event is new, False if it was already seen or is still being processed
+        """
+        key = self.event_key(event)
+        now = time.monotonic()
+
+        with self._lock:
+            if retry_num is not None:
+                self.retries += 1
+
+            if key is None:
+                self.misses += 1
+                return True
+
+            self._expire(now)
+
+            if key in self._seen:
+                self.hits += 1
+                logger.debug("Skipping duplicate event {key} (retry: {retry_num}, reason: {retry_reason})"
+                             .format(key=key, retry_num=retry_num, retry_reason=retry_reason))
+                return False
+
+            self.misses += 1
+            self._seen[key] = now
+            while len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+
+        return True
+
+    def stats(self):
+        """Counters on how much duplicate work has been skipped
+
+        Returns:
+            dict -- hits, misses, retries and the number of events currently remembered
+        """
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'retries': self.retries,
+                    'size': len(self._seen),
+                    }
+
+    def _expire(self, now):
+        # Items are in insertion order, so stop at the first one that has not expired
+        while self._seen:
+            key, seen_at = next(iter(self._seen.items()))
+            if now - seen_at < self.ttl:
+                break
+            self._seen.popitem(last=False)
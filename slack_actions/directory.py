@@ -0,0 +1,514 @@
+import os
+import re
+import sys
+import json
+import time
+import logging
+import sqlite3
+import threading
+import contextlib
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from slack_actions.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Slack ids are all uppercase (U123ABC, C123ABC, ...), names are always lowercase
+SLACK_ID_RE = re.compile(r'^[A-Z][A-Z0-9]+$')
+
+# Fields kept by default when using compact records, anything else is fetched from slack when it is used
+USER_FIELDS = ('id', 'name', 'real_name', 'team_id', 'tz', 'deleted', 'is_bot', 'is_admin', 'is_owner')
+CHANNEL_FIELDS = ('id', 'name', 'user', 'is_channel', 'is_group', 'is_im', 'is_mpim', 'is_private', 'is_archived',
+                  'is_member')
+
+_MISSING = object()
+
+
+class CompactRecord(dict):
+    """A user or channel that only keeps some of the fields from the slack api
+
+    It is a dict of the fields that were kept, so it can be changed and saved as json like the full record. Reading a
+    field that was not kept with `record[key]` or `record.get(key)` gets it from the full record, which is fetched
+    from the slack api the first time (see `Directory.get_full`). `in`, `keys()` and iterating only see the kept
+    fields. Use `make_record_class` to create a class with the fields to keep.
+    """
+
+    __slots__ = ()
+    _fields = ()
+    _fetch_full = None
+
+    def __init__(self, record):
+        """
+        Arguments:
+            record {dict} -- The record from the slack api
+        """
+        super().__init__()
+        for field in self._fields:
+            value = record.get(field, _MISSING)
+            if value is _MISSING:
+                continue
+            if field in ('id', 'name') and isinstance(value, str):
+                # The same ids and names are used all over, only keep a single copy of each
+                value = sys.intern(value)
+            self[field] = value
+
+    def __missing__(self, key):
+        if key in self._fields:
+            # Was kept, the record just does not have it
+            raise KeyError(key)
+
+        return self.full()[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, super().__repr__())
+
+    def __reduce__(self):
+        # The record classes are created at run time and can not be imported, so pickle it as a plain dict
+        return (dict, (dict(self),))
+
+    def full(self):
+        """Get all the fields of the record from the slack api
+
+        Returns:
+            dict -- The full record, empty if it could not be fetched
+        """
+        return self._fetch_full(dict.__getitem__(self, 'id')) or {}
+
+
+def make_record_class(fields, fetch_full, name='CompactRecord'):
+    """Create a CompactRecord class that keeps the given fields
+
+    Arguments:
+        fields {list} -- Fields to keep, `id` and `name` are always kept
+        fetch_full {function} -- Takes an id and returns the full record from the slack api
+
+    Keyword Arguments:
+        name {str} -- Name of the class (default: {'CompactRecord'})
+
+    Returns:
+        type -- The subclass of CompactRecord
+    """
+    fields = tuple(dict.fromkeys(('id', 'name') + tuple(fields)))
+    return type(name, (CompactRecord,), {'__slots__': (),
+                                         '_fields': fields,
+                                         '_fetch_full': staticmethod(fetch_full),
+                                         '__module__': __name__,
+                                         })
+
+
+class MemoryDirectoryStore:
+    """Keeps the records in a dict, only for this process"""
+
+    def __init__(self):
+        self._records = {}  # Each record is in here twice, by name and by id
+        self._lock = threading.Lock()
+        self._refresh_claimed_at = None
+
+    def get(self, key):
+        return self._records.get(key)
+
+    def keys(self):
+        return list(self._records)
+
+    def __len__(self):
+        return len(self._records)
+
+    def unique_records(self):
+        return [record for key, record in list(self._records.items()) if key == record['id']]
+
+    def replace(self, records):
+        new_records = {}
+        for record in records:
+            if record.get('name') is not None:
+                new_records[record['name']] = record
+            new_records[record['id']] = record
+
+        with self._lock:
+            self._records = new_records
+            self._refresh_claimed_at = time.monotonic()
+
+    def add(self, record):
+        with self._lock:
+            old_record = self._records.get(record['id'])
+            if old_record is not None and old_record.get('name') != record.get('name'):
+                # Was renamed, the old name should not point to it anymore
+                self._records.pop(old_record.get('name'), None)
+
+            if record.get('name') is not None:
+                self._records[record['name']] = record
+            self._records[record['id']] = record
+
+    def remove(self, record_id):
+        with self._lock:
+            record = self._records.pop(record_id, None)
+            if record is not None and self._records.get(record.get('name')) is record:
+                self._records.pop(record['name'])
+
+    def claim_refresh(self, min_interval):
+        with self._lock:
+            now = time.monotonic()
+            if self._refresh_claimed_at is not None and now - self._refresh_claimed_at < min_interval:
+                return False
+            self._refresh_claimed_at = now
+            return True
+
+
+class SqliteDirectoryStore:
+    """Keeps the records in a sqlite file that every worker on the host shares
+
+    Each record is saved once, the file is memory mapped so all the workers read from the same os page cache.
+    Only one worker does a refresh, the others see its results.
+    """
+
+    def __init__(self, path, name):
+        """
+        Arguments:
+            path {str} -- Path of the sqlite file, it is created if it does not exist
+            name {str} -- Name of the directory (`users` or `channels`), used as the table name
+        """
+        if not re.match(r'^[a-z_]+$', name):
+            raise ValueError("Invalid directory name {}".format(name))
+
+        self.path = path
+        self.name = name
+        self._local = threading.local()  # sqlite connections can not be shared between threads
+
+        with self._transaction() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS {} (id TEXT PRIMARY KEY, name TEXT, data TEXT NOT NULL)'
+                         .format(name))
+            conn.execute('CREATE INDEX IF NOT EXISTS {name}_name ON {name} (name)'.format(name=name))
+            conn.execute('CREATE TABLE IF NOT EXISTS directory_refreshes '
+                         '(directory TEXT PRIMARY KEY, claimed_at REAL NOT NULL)')
+
+    def _connect(self):
+        # Also need a new connection after gunicorn forks the worker
+        if getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA mmap_size=268435456')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+
+        return self._local.conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def get(self, key):
+        row = self._connect().execute('SELECT data FROM {name} WHERE id = ? '
+                                      'UNION ALL SELECT data FROM {name} WHERE name = ? LIMIT 1'
+                                      .format(name=self.name), (key, key)).fetchone()
+        if row is None:
+            return None
+
+        return json.loads(row[0])
+
+    def keys(self):
+        keys = []
+        for record_id, name in self._connect().execute('SELECT id, name FROM {}'.format(self.name)):
+            if name is not None:
+                keys.append(name)
+            keys.append(record_id)
+
+        return keys
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) + COUNT(name) FROM {}'.format(self.name)).fetchone()[0]
+
+    def unique_records(self):
+        return [json.loads(data) for data, in self._connect().execute('SELECT data FROM {}'.format(self.name))]
+
+    def replace(self, records):
+        rows = [(record['id'], record.get('name'), json.dumps(dict(record), separators=(',', ':')))
+                for record in records]
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM {}'.format(self.name))
+            conn.executemany('INSERT OR REPLACE INTO {} (id, name, data) VALUES (?, ?, ?)'.format(self.name), rows)
+            conn.execute('INSERT OR REPLACE INTO directory_refreshes (directory, claimed_at) VALUES (?, ?)',
+                         (self.name, time.time()))
+
+    def add(self, record):
+        with self._transaction() as conn:
+            if record.get('name') is not None:
+                # Something else used to have this name
+                conn.execute('UPDATE {} SET name = NULL WHERE name = ? AND id != ?'.format(self.name),
+                             (record['name'], record['id']))
+            conn.execute('INSERT OR REPLACE INTO {} (id, name, data) VALUES (?, ?, ?)'.format(self.name),
+                         (record['id'], record.get('name'), json.dumps(dict(record), separators=(',', ':'))))
+
+    def remove(self, record_id):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM {} WHERE id = ?'.format(self.name), (record_id,))
+
+    def claim_refresh(self, min_interval):
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute('SELECT claimed_at FROM directory_refreshes WHERE directory = ?',
+                               (self.name,)).fetchone()
+            if row is not None and now - row[0] < min_interval:
+                return False
+            conn.execute('INSERT OR REPLACE INTO directory_refreshes (directory, claimed_at) VALUES (?, ?)',
+                         (self.name, now))
+            return True
+
+
+class Directory(Mapping):
+    """The users or channels from the slack api, accessible by name or id
+
+    Reading it like a dict only returns what is already loaded, use `lookup` to also ask the slack api on a miss.
+    Where the records are kept is up to the store, by default they are in memory in each process.
+    A store needs the methods `get`, `keys`, `__len__`, `unique_records`, `replace`, `add`, `remove`
+    and `claim_refresh`, see `MemoryDirectoryStore` and `SqliteDirectoryStore`.
+    """
+
+    def __init__(self, fetch_all, fetch_one, store=None, negative_ttl=300, min_refresh_interval=30,
+                 full_cache_size=1000, negative_max_size=10000):
+        """
+        Arguments:
+            fetch_all {function} -- Returns a dict of all the records, accessible by name and id
+            fetch_one {function} -- Takes an id and returns its record, or None if it does not exist
+
+        Keyword Arguments:
+            store {object} -- Where to keep the records, defaults to a MemoryDirectoryStore (default: {None})
+            negative_ttl {int} -- Seconds to remember that a key does not exist before asking slack again
+                                  (default: {300})
+            min_refresh_interval {int} -- Min seconds between refreshing the full list when a name is not found
+                                          (default: {30})
+            full_cache_size {int} -- Max number of full records to keep for the compact records, the least recently
+                                     used are dropped first (default: {1000})
+            negative_max_size {int} -- Max number of keys to remember that do not exist, the oldest are dropped first
+                                       (default: {10000})
+        """
+        self._fetch_all = fetch_all
+        self._fetch_one = fetch_one
+        self.store = store if store is not None else MemoryDirectoryStore()
+        self.negative_ttl = negative_ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.negative_max_size = negative_max_size
+        # key -> time to stop remembering that it does not exist, oldest first. Bounded, since anyone who can post
+        # events can send made up ids
+        self._missing = OrderedDict()
+
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()  # What is being fetched from slack right now, None for the full list
+
+        self.record_class = None  # Set by `use_compact_records`
+        self.full_cache_size = full_cache_size
+        # id -> full record, for the fields the compact records do not keep. Kept here and not on each record, the
+        # store can give a new record every time (like SqliteDirectoryStore)
+        self._full_records = OrderedDict()
+
+        # Counts of `lookup`, a miss is when the slack api had to be asked
+        self.hits = 0
+        self.misses = 0
+
+    def use_compact_records(self, fields, name='CompactRecord'):
+        """Only keep some of the fields of each record, the rest are fetched from slack if they are used
+
+        Only applies to records added after this is called
+
+        Arguments:
+            fields {list} -- Fields to keep, `id` and `name` are always kept
+
+        Keyword Arguments:
+            name {str} -- Name of the record class (default: {'CompactRecord'})
+        """
+        self.record_class = make_record_class(fields, self.get_full, name=name)
+
+    def get_full(self, record_id):
+        """Get the full record from the slack api, used by the compact records for the fields they do not keep
+
+        The last `full_cache_size` are kept, so using the same field of a record again does not call the slack api
+
+        Arguments:
+            record_id {str} -- Id of the record
+
+        Returns:
+            dict/None -- The full record, None if it does not exist
+        """
+        with self._lock:
+            record = self._full_records.get(record_id)
+            if record is not None:
+                self._full_records.move_to_end(record_id)
+                return record
+
+        record = self._flights.do(('full', record_id), self._fetch_one, record_id)[0]
+        if record is not None:
+            self._keep_full(record)
+        return record
+
+    def _keep_full(self, record):
+        with self._lock:
+            self._full_records[record['id']] = record
+            self._full_records.move_to_end(record['id'])
+            while len(self._full_records) > self.full_cache_size:
+                self._full_records.popitem(last=False)
+
+    def _compact(self, record):
+        if self.record_class is None or record is None or isinstance(record, self.record_class):
+            return record
+
+        return self.record_class(record)
+
+    def __getitem__(self, key):
+        record = self.store.get(key)
+        if record is None:
+            raise KeyError(key)
+        return self._compact(record)
+
+    def get(self, key, default=None):
+        record = self.store.get(key)
+        if record is None:
+            return default
+        return self._compact(record)
+
+    def __contains__(self, key):
+        return self.store.get(key) is not None
+
+    def __iter__(self):
+        return iter(self.store.keys())
+
+    def __len__(self):
+        return len(self.store)
+
+    def unique_records(self):
+        """Get each record once, instead of once by name and once by id
+
+        Returns:
+            list -- All the records
+        """
+        return self.store.unique_records()
+
+    def lookup(self, key):
+        """Get the record, asking the slack api if it is not loaded yet
+
+        An id is fetched on its own, a name can only be found by refreshing the full list
+
+        Arguments:
+            key {str} -- Either the name or id of the record
+
+        Returns:
+            dict/None -- The record, None if it does not exist
+        """
+        record = self.store.get(key)
+        if record is not None:
+            self.hits += 1
+            return self._compact(record)
+
+        missing_until = self._missing.get(key)
+        if missing_until is not None:
+            if missing_until > time.monotonic():
+                self.hits += 1
+                return None
+            with self._lock:
+                self._missing.pop(key, None)
+
+        self.misses += 1
+
+        if SLACK_ID_RE.match(key):
+            record = self._flights.do(key, self._fetch_one, key)[0]
+            if record is not None:
+                self.add(record)
+            record = self._compact(record)
+        else:
+            self.refresh(force=False)
+            record = self._compact(self.store.get(key))
+
+        if record is None:
+            self._remember_missing(key)
+
+        return record
+
+    def _remember_missing(self, key):
+        now = time.monotonic()
+        with self._lock:
+            self._missing[key] = now + self.negative_ttl
+            self._missing.move_to_end(key)
+            # All use the same ttl, so the ones that expired are at the front
+            while self._missing:
+                oldest_key, missing_until = next(iter(self._missing.items()))
+                if missing_until > now and len(self._missing) <= self.negative_max_size:
+                    break
+                del self._missing[oldest_key]
+
+    def stats(self):
+        """Counts of the lookups
+
+        Returns:
+            dict -- hits, misses and number of records (each one is counted by name and by id)
+        """
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self),
+                }
+
+    def refresh(self, force=True):
+        """Replace all the records with the full list from the slack api
+
+        Only one refresh runs at a time, if one is already running this waits for it to finish
+
+        Keyword Arguments:
+            force {bool} -- Refresh even if the last refresh was less then `min_refresh_interval` seconds ago,
+                            or another process sharing the store already did it (default: {True})
+        """
+        def fetch_all():
+            # Claimed inside the flight, so a lookup that comes in while the refresh is running waits for it instead
+            # of seeing the claim and giving up before the records are in the store
+            if not force and not self.store.claim_refresh(self.min_refresh_interval):
+                return None
+            return self._fetch_all()
+
+        records, _ = self._flights.do(None, fetch_all)
+        if records is not None:
+            self.replace(records)
+
+    def replace(self, records):
+        """Replace all the records
+
+        Arguments:
+            records {dict} -- All the records, accessible by name and id
+        """
+        self.store.replace([self._compact(record) for key, record in records.items() if key == record['id']])
+        with self._lock:
+            self._missing = OrderedDict()
+            self._full_records.clear()
+
+    def add(self, record):
+        """Add or update a single record
+
+        Arguments:
+            record {dict} -- The record from the slack api
+        """
+        if self.record_class is not None and not isinstance(record, CompactRecord):
+            # Already have the full record (from `users.info` or a `user_change` event), no need to fetch it again
+            self._keep_full(record)
+        record = self._compact(record)
+        self.store.add(record)
+        with self._lock:
+            self._missing.pop(record['id'], None)
+            self._missing.pop(record.get('name'), None)
+
+    def remove(self, record_id):
+        """Remove a single record
+
+        Arguments:
+            record_id {str} -- Id of the record
+        """
+        self.store.remove(record_id)
+        with self._lock:
+            self._full_records.pop(record_id, None)
@@ -0,0 +1,91 @@
+import queue
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class EventQueue:
+    """Bounded in-process work queue served by a pool of worker threads
+
+    Used by `api.Event` so slack gets its 200 right away and the event is processed after the response was sent
+    """
+
+    def __init__(self, num_workers=4, max_size=1000):
+        """
+        Keyword Arguments:
+            num_workers {int} -- Number of threads pulling work off of the queue (default: {4})
+            max_size {int} -- Max number of events waiting to be processed (default: {1000})
+        """
+        if num_workers < 1:
+            raise ValueError("num_workers must be at least 1")
+
+        self.num_workers = num_workers
+        self.max_size = max_size
+        self._queue = queue.Queue(maxsize=max_size)
+        self._workers = []
+
+    def start(self):
+        """Start the worker threads, does nothing if they are already running"""
+        if self._workers:
+            return
+
+        for idx in range(self.num_workers):
+            worker = threading.Thread(target=self._worker,
+                                      name='slack-actions-worker-{}'.format(idx),
+                                      daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self, wait=True):
+        """Stop the worker threads once everything already queued has been processed
+
+        Keyword Arguments:
+            wait {bool} -- Block until all the workers have exited (default: {True})
+        """
+        for _ in self._workers:
+            # Blocking put, the sentinel must get in even if the queue is full
+            self._queue.put(None)
+
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+        self._workers = []
+
+    def submit(self, fn, *args, **kwargs):
+        """Add work to the queue without blocking
+
+        Arguments:
+            fn {function} -- Function to be called on a worker thread with the args and kwargs
+
+        Returns:
+            bool -- True if the work was queued, False if the queue is full
+        """
+        try:
+            self._queue.put_nowait((fn, args, kwargs))
+        except queue.Full:
+            return False
+
+        return True
+
+    def qsize(self):
+        """Number of items waiting to be processed"""
+        return self._queue.qsize()
+
+    def _worker(self):
+        while True:
+            work = self._queue.get()
+            try:
+                if work is None:
+                    # Sentinel sent by stop()
+                    return
+
+                fn, args, kwargs = work
+                fn(*args, **kwargs)
+
+            except Exception:
+                logger.exception("Broke processing queued work")
+
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,346 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import multiprocessing
+import concurrent.futures
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# What can be passed in a trigger's `execution` option
+EXECUTION_OPTIONS = {'timeout', 'executor', 'workers', 'max_failures', 'reset_after'}
+EXECUTORS = {'inline', 'shared', 'dedicated', 'process'}
+
+
+class CircuitBreaker:
+    """Stops running a callback after it failed too many times in a row, and tries it again after a cool down
+
+    `closed` runs the callback as normal, `open` skips it, and `half_open` lets a single call through to see if it
+    works again
+    """
+
+    def __init__(self, max_failures=5, reset_after=60):
+        """
+        Keyword Arguments:
+            max_failures {int} -- Failures (exceptions or timeouts) in a row before it opens (default: {5})
+            reset_after {float} -- Seconds to stay open before trying the callback again (default: {60})
+        """
+        self.max_failures = max_failures
+        self.reset_after = reset_after
+        self.state = 'closed'
+        self.failures = 0  # In a row
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Check if the callback can be run
+
+        Returns:
+            bool -- False if it should be skipped
+        """
+        with self._lock:
+            if self.state == 'closed':
+                return True
+
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_after:
+                # Let one call through to test it
+                self.state = 'half_open'
+                return True
+
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.max_failures:
+                if self.state != 'open':
+                    logger.warning("Circuit breaker opened after {} failures".format(self.failures))
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+
+class CallbackRunner:
+    """Runs the callbacks using the `execution` option of their triggers
+
+        @slack_controller.trigger(['message'], {'text': '^report'},
+                                  execution={'timeout': 10, 'executor': 'dedicated', 'max_failures': 3})
+
+    - timeout: Seconds to wait on the callback, after that its output is ignored (the thread can not be stopped).
+               Can not be used with the `inline` executor
+    - executor: `inline` runs it in the thread processing the event (the default without a timeout),
+                `shared` in a pool shared by all callbacks (the default with a timeout),
+                `dedicated` in a pool only for this callback, so it can not hold up the others
+    - workers: Size of the dedicated pool (default 1)
+    - executor `process`: In the process pool, for cpu heavy callbacks. The callback gets a copy of the event as a
+                plain dict, so it and its arguments have to be picklable (functions and methods of picklable objects)
+    - max_failures/reset_after: Turn on the circuit breaker, see `CircuitBreaker`
+    """
+
+    def __init__(self, shared_workers=8, metrics=None):
+        """
+        Keyword Arguments:
+            shared_workers {int} -- Size of the pool shared by all callbacks (default: {8})
+            metrics {Metrics} -- Count the timeouts, errors and skipped calls of each callback (default: {None})
+        """
+        self.shared_workers = shared_workers
+        self.metrics = metrics
+        # Used by the `process` executor, the initializer sets up each worker process. Set by the controller
+        self.process_workers = None  # None for the number of cpus
+        self.process_initializer = None
+        self.process_initargs = ()
+        self._process_pool = None
+        self._shared_pool = None
+        self._dedicated_pools = {}  # callback -> ThreadPoolExecutor
+        self._breakers = {}  # callback -> CircuitBreaker
+        self._stats = {}  # callback -> counts
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def check_options(options):
+        """Make sure the `execution` option of a trigger is valid
+
+        Arguments:
+            options {dict} -- The execution options
+
+        Raises:
+            ValueError -- If it has an unknown key or executor, or a timeout with the `inline` executor
+        """
+        unknown = set(options) - EXECUTION_OPTIONS
+        if unknown:
+            raise ValueError("Unknown execution options {}, must be from {}"
+                             .format(sorted(unknown), sorted(EXECUTION_OPTIONS)))
+        if options.get('executor', 'inline') not in EXECUTORS:
+            raise ValueError("Unknown executor {!r}, must be one of {}".format(options['executor'], sorted(EXECUTORS)))
+        if options.get('executor') == 'inline' and options.get('timeout'):
+            # It runs in the thread processing the event, there is nothing to stop waiting on
+            raise ValueError("A timeout can not be used with the inline executor, use `shared` or `dedicated`")
+
+    def _get_executor(self, callback, options):
+        """Get the pool to run the callback in, None to run it in the current thread"""
+        executor = options.get('executor')
+        if executor is None:
+            executor = 'shared' if options.get('timeout') else 'inline'
+
+        if executor == 'inline':
+            return None
+
+        if executor == 'process':
+            return self.get_process_pool()
+
+        with self._lock:
+            if executor == 'dedicated':
+                pool = self._dedicated_pools.get(callback)
+                if pool is None:
+                    pool = self._dedicated_pools[callback] = ThreadPoolExecutor(
+                        max_workers=options.get('workers', 1),
+                        thread_name_prefix='slack-actions-callback-{}'.format(callback.__name__))
+                return pool
+
+            if self._shared_pool is None:
+                self._shared_pool = ThreadPoolExecutor(max_workers=self.shared_workers,
+                                                       thread_name_prefix='slack-actions-callback')
+            return self._shared_pool
+
+    def get_process_pool(self):
+        """Get the pool used by the `process` executor, it is created the first time and after a worker died
+
+        The workers are started by a forkserver, forking this process could copy a lock held by one of its other
+        threads into the worker and deadlock it
+
+        Returns:
+            concurrent.futures.ProcessPoolExecutor -- The pool
+        """
+        with self._lock:
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(max_workers=self.process_workers,
+                                                         mp_context=multiprocessing.get_context('forkserver'),
+                                                         initializer=self.process_initializer,
+                                                         initargs=self.process_initargs)
+            return self._process_pool
+
+    def _reset_process_pool(self, pool):
+        """Drop a broken process pool, so the next callback starts a new one"""
+        with self._lock:
+            if self._process_pool is pool:
+                self._process_pool = None
+
+        pool.shutdown(wait=False)
+
+    def warm_process_pool(self):
+        """Start all the worker processes now, so the first callbacks do not wait for them to start"""
+        pool = self.get_process_pool()
+        num_workers = self.process_workers or os.cpu_count() or 1
+        for future in [pool.submit(os.getpid) for _ in range(num_workers)]:
+            future.result()
+
+    def _get_breaker(self, callback, options):
+        if 'max_failures' not in options and 'reset_after' not in options:
+            return None
+
+        breaker = self._breakers.get(callback)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(callback,
+                                                    CircuitBreaker(max_failures=options.get('max_failures', 5),
+                                                                   reset_after=options.get('reset_after', 60)))
+        return breaker
+
+    def _count(self, callback, key):
+        with self._lock:
+            callback_stats = self._stats.setdefault(callback, {'calls': 0, 'errors': 0, 'timeouts': 0,
+                                                               'skipped': 0})
+            callback_stats[key] += 1
+
+        if key != 'calls' and self.metrics is not None:
+            self.metrics.incr('callback_{}'.format(key), callback=_callback_name(callback))
+
+    def _skip(self, callback, breaker):
+        if breaker is not None and not breaker.allow():
+            self._count(callback, 'skipped')
+            return True
+
+        self._count(callback, 'calls')
+        return False
+
+    def _failed(self, callback, breaker, key):
+        self._count(callback, key)
+        if breaker is not None:
+            breaker.record_failure()
+
+    def _process_pool_broke(self, callback, breaker, pool):
+        # A worker process died (killed, out of memory, os._exit), every call to the pool fails after that
+        self._failed(callback, breaker, 'errors')
+        logger.error("A worker process died while running {}, starting a new process pool".format(callback.__name__))
+        self._reset_process_pool(pool)
+
+    def run(self, callback, options, call):
+        """Run the callback
+
+        Arguments:
+            callback {function} -- The callback, its state is kept by this
+            options {dict} -- The `execution` option of the trigger that matched
+            call {function} -- Runs the callback with its arguments
+
+        Returns:
+            The output of the callback, None if it was skipped by the circuit breaker or timed out
+
+        Raises:
+            Any exception the callback raised
+        """
+        if not options:
+            return call()
+
+        breaker = self._get_breaker(callback, options)
+        if self._skip(callback, breaker):
+            return None
+
+        executor = self._get_executor(callback, options)
+        try:
+            if executor is None:
+                callback_output = call()
+            else:
+                callback_output = executor.submit(call).result(timeout=options.get('timeout'))
+
+        except concurrent.futures.TimeoutError:
+            self._failed(callback, breaker, 'timeouts')
+            logger.error("Callback {} did not finish within {}s".format(callback.__name__, options['timeout']))
+            return None
+
+        except BrokenProcessPool:
+            self._process_pool_broke(callback, breaker, executor)
+            return None
+
+        except Exception:
+            self._failed(callback, breaker, 'errors')
+            raise
+
+        if breaker is not None:
+            breaker.record_success()
+
+        return callback_output
+
+    async def run_async(self, callback, options, call):
+        """Same as `run`, but for the asgi app. `async def` callbacks are awaited, others are run in an executor"""
+        options = options or {}
+        breaker = self._get_breaker(callback, options)
+        if options and self._skip(callback, breaker):
+            return None
+
+        executor = None
+        try:
+            if asyncio.iscoroutinefunction(callback) and options.get('executor') != 'process':
+                callback_output = await asyncio.wait_for(call(), options.get('timeout'))
+            else:
+                executor = self._get_executor(callback, options)
+                if executor is None and options:
+                    # Can not block the event loop, so `inline` uses the shared pool
+                    executor = self._get_executor(callback, dict(options, executor='shared'))
+                future = asyncio.get_running_loop().run_in_executor(executor, call)
+                callback_output = await asyncio.wait_for(future, options.get('timeout'))
+
+        except asyncio.TimeoutError:
+            self._failed(callback, breaker, 'timeouts')
+            logger.error("Callback {} did not finish within {}s".format(callback.__name__, options['timeout']))
+            return None
+
+        except BrokenProcessPool:
+            self._process_pool_broke(callback, breaker, executor)
+            return None
+
+        except Exception:
+            if options:
+                self._failed(callback, breaker, 'errors')
+            raise
+
+        if breaker is not None:
+            breaker.record_success()
+
+        return callback_output
+
+    def states(self):
+        """The counts and circuit breaker state of each callback that has `execution` options
+
+        Returns:
+            dict -- callback name -> calls, errors, timeouts, skipped, breaker state and failures in a row
+        """
+        with self._lock:
+            callbacks = set(self._stats) | set(self._breakers)
+            states = {}
+            for callback in callbacks:
+                state = dict(self._stats.get(callback, {'calls': 0, 'errors': 0, 'timeouts': 0, 'skipped': 0}))
+                breaker = self._breakers.get(callback)
+                state['breaker'] = breaker.state if breaker is not None else None
+                state['failures'] = breaker.failures if breaker is not None else 0
+                states[_callback_name(callback)] = state
+
+        return states
+
+    def gauges(self):
+        """1 for each callback whose circuit breaker is not closed, for the metrics"""
+        with self._lock:
+            return [('callback_breaker_open', {'callback': _callback_name(callback)}, int(breaker.state != 'closed'))
+                    for callback, breaker in self._breakers.items()]
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            pools = list(self._dedicated_pools.values())
+            pools.extend(pool for pool in (self._shared_pool, self._process_pool) if pool is not None)
+            self._dedicated_pools = {}
+            self._shared_pool = None
+            self._process_pool = None
+
+        for pool in pools:
+            pool.shutdown(wait=wait)
+
+
+def _callback_name(callback):
+    """Name used for the callback in the logs and metrics, like `CommandClass.upload_csv`"""
+    return getattr(callback, '__qualname__', None) or getattr(callback, '__name__', repr(callback))
@@ -0,0 +1,170 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from slack_actions.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+class FileCache:
+    """Keeps downloaded slack files on disk so the same file is only downloaded once
+
+    Files are stored by a hash of their slack file id and version (its `timestamp`), so a file that was edited is
+    downloaded again. When the files take up more then `max_size` bytes, the least recently used ones are removed.
+    The directory can be shared by workers on the same host, each one keeps its own count of the size.
+    """
+
+    def __init__(self, path, max_size=1024 ** 3):
+        """
+        Arguments:
+            path {str} -- Directory to keep the files in, it is created if it does not exist
+
+        Keyword Arguments:
+            max_size {int} -- Max number of bytes to keep (default: {1GB})
+        """
+        self.path = path
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+        self._entries = OrderedDict()  # cache key -> size, least recently used first
+        self._total_size = 0
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(path, exist_ok=True)
+        self._load_entries()
+
+    @staticmethod
+    def cache_key(file_id, version=None):
+        """Key of a version of a slack file
+
+        Arguments:
+            file_id {str} -- The slack file id (F123ABC)
+
+        Keyword Arguments:
+            version {str} -- Changes when the file changes, like its `timestamp` or a hash (default: {None})
+
+        Returns:
+            str -- The key used as the cached file's name
+        """
+        return hashlib.sha256('{}:{}'.format(file_id, version).encode('utf-8')).hexdigest()
+
+    def _file_path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def _load_entries(self):
+        """Add the files that are already in the directory, from a previous run or another worker"""
+        found = []
+        for dir_entry in os.scandir(self.path):
+            if not dir_entry.is_dir():
+                continue
+            for file_entry in os.scandir(dir_entry.path):
+                # Skip the temp files of downloads in progress
+                if file_entry.is_file() and not file_entry.name.startswith('.'):
+                    stat = file_entry.stat()
+                    found.append((stat.st_mtime, file_entry.name, stat.st_size))
+
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_size += size
+
+        self._evict()
+
+    def open(self, key, download):
+        """Open the cached file, downloading it first if it is not cached yet
+
+        If another thread is already downloading the same file, this waits for it instead of downloading it again
+
+        Arguments:
+            key {str} -- The key from `cache_key`
+            download {function} -- Takes the path to save the file to, returns None if the download failed
+
+        Returns:
+            file/None -- The cached file opened for reading in binary mode, None if the download failed
+        """
+        cached_file = self._open_cached(key)
+        if cached_file is not None:
+            self.hits += 1
+            return cached_file
+
+        downloaded, shared = self._flights.do(key, self._download, key, download)
+        if shared:
+            # Another thread downloaded it
+            self.hits += 1
+
+        return self._open_cached(key) if downloaded else None
+
+    def _download(self, key, download):
+        self.misses += 1
+        file_path = self._file_path(key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        # `download` writes to a temp file and moves it into place, so the cache never has part of a file
+        if download(file_path) is None:
+            return False
+
+        self._add(key, os.path.getsize(file_path))
+        return True
+
+    def _open_cached(self, key):
+        with self._lock:
+            try:
+                # Opened while holding the lock, so it can be read even if it is evicted right after
+                cached_file = open(self._file_path(key), 'rb')
+            except FileNotFoundError:
+                self._remove_entry(key)
+                return None
+
+            size = self._entries.pop(key, None)
+            if size is None:
+                # Added by another worker
+                size = os.fstat(cached_file.fileno()).st_size
+                self._total_size += size
+            self._entries[key] = size
+
+        try:
+            # So the least recently used order is kept between restarts
+            os.utime(self._file_path(key))
+        except OSError:
+            pass
+
+        return cached_file
+
+    def _add(self, key, size):
+        with self._lock:
+            self._remove_entry(key)
+            self._entries[key] = size
+            self._total_size += size
+            self._evict()
+
+    def _remove_entry(self, key):
+        # Must hold self._lock
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total_size -= size
+
+    def _evict(self):
+        # Must hold self._lock (or be in __init__)
+        while self._total_size > self.max_size and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total_size -= size
+            try:
+                os.remove(self._file_path(key))
+            except FileNotFoundError:
+                pass
+            logger.debug("Removed {} from the file cache".format(key))
+
+    def stats(self):
+        """Counts of the cache
+
+        Returns:
+            dict -- hits, misses, number of files and total size in bytes
+        """
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'files': len(self._entries),
+                    'size': self._total_size,
+                    }
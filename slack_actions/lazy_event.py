@@ -0,0 +1,64 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Keys that are always in the event, None if they were never set
+LAZY_KEYS = ('sa_user', 'sa_channel')
+
+
+class LazyEvent(dict):
+    """The event sent by slack, where `sa_user` and `sa_channel` are only looked up the first time they are used
+
+    Most events do not trigger anything, so looking up the user and channel for every one of them is wasted work
+    """
+
+    __slots__ = ('_resolvers',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._resolvers = {}
+
+    def lazy(self, key, resolver):
+        """Set how to get the value of a key the first time it is used
+
+        Arguments:
+            key {str} -- The key, like `sa_user`
+            resolver {function} -- Takes no arguments and returns the value
+        """
+        self.pop(key, None)
+        self._resolvers[key] = resolver
+
+    def __missing__(self, key):
+        resolver = self._resolvers.pop(key, None)
+        if resolver is None:
+            if key in LAZY_KEYS:
+                return None
+            raise KeyError(key)
+
+        try:
+            value = resolver()
+        except Exception:
+            logger.exception("Broke generating `event` {}".format(key))
+            value = None
+
+        self[key] = value
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return super().__contains__(key) or key in LAZY_KEYS or key in self._resolvers
+
+    def __reduce__(self):
+        # Pickle it as a plain dict with everything looked up
+        self.resolve_all()
+        return (dict, (dict(self),))
+
+    def resolve_all(self):
+        """Look up all of the lazy keys now"""
+        for key in LAZY_KEYS + tuple(self._resolvers):
+            self[key] = self[key]
@@ -0,0 +1,228 @@
+import re
+
+
+class FieldPath:
+    """A trigger key (like `actions.selected_options.value`) split up once so it can be looked up in any event
+
+    If a part of the path hits a list, the part is used as the index if it is a number,
+    otherwise the first item in the list is used and then the part is used as the key of that item.
+    """
+
+    __slots__ = ('key', 'parts')
+
+    def __init__(self, key):
+        """
+        Arguments:
+            key {str} -- Dot separated path to the field
+        """
+        self.key = key
+        parts = []
+        for part in key.split('.'):
+            try:
+                idx = int(part)
+            except ValueError:
+                idx = None
+            parts.append((part, idx))
+
+        self.parts = tuple(parts)
+
+    def resolve(self, data):
+        """Get the value of the field, without copying the data
+
+        Arguments:
+            data {dict} -- The event data to get the field from
+
+        Returns:
+            The value of the field
+
+        Raises:
+            KeyError/IndexError -- If the field is not in the data
+        """
+        for part, idx in self.parts:
+            if isinstance(data, list):
+                # check if current key is an index, if so use it, otherwise default to 0
+                if idx is not None:
+                    data = data[idx]
+                    continue  # Move on to the next part
+
+                # Default to the first item and then use the next key
+                data = data[0]
+
+            data = data[part]
+
+        return data
+
+    def __repr__(self):
+        return 'FieldPath({!r})'.format(self.key)
+
+
+def resolve_field(field, event_data, field_cache):
+    """Get the value of the field, only looking it up in the event once
+
+    Arguments:
+        field {FieldPath} -- The field to get
+        event_data {dict} -- The event data to get the field from
+        field_cache {dict} -- Fields already pulled out of this event
+
+    Returns:
+        The value of the field
+    """
+    if field.key in field_cache:
+        return field_cache[field.key]
+
+    value = field.resolve(event_data)
+    field_cache[field.key] = value
+    return value
+
+
+def _strip_groups(pattern):
+    """Turn all capturing groups in the pattern into non-capturing groups
+
+    This lets many patterns be joined together into a single alternation without their group names/numbers clashing
+
+    Arguments:
+        pattern {str} -- The regex pattern
+
+    Returns:
+        str/None -- The pattern without any capturing groups,
+                    None if the pattern cannot be safely joined with others (backreferences, global flags, ...)
+    """
+    stripped = []
+    idx = 0
+    in_class = False
+    while idx < len(pattern):
+        char = pattern[idx]
+
+        if char == '\\':
+            next_char = pattern[idx + 1:idx + 2]
+            if not in_class and next_char and next_char in '123456789':
+                # Backreference to a group number
+                return None
+            stripped.append(pattern[idx:idx + 2])
+            idx += 2
+            continue
+
+        if in_class:
+            if char == ']':
+                in_class = False
+
+        elif char == '[':
+            in_class = True
+            stripped.append(char)
+            idx += 1
+            # A `]` right at the start of the class is a literal
+            if pattern[idx:idx + 1] == '^':
+                stripped.append('^')
+                idx += 1
+            if pattern[idx:idx + 1] == ']':
+                stripped.append(']')
+                idx += 1
+            continue
+
+        elif char == '(':
+            if pattern.startswith('(?P<', idx):
+                end = pattern.find('>', idx)
+                if end == -1:
+                    return None
+                stripped.append('(?:')
+                idx = end + 1
+                continue
+
+            if pattern.startswith('(?P=', idx) or pattern.startswith('(?(', idx):
+                # Named backreference or conditional on a group
+                return None
+
+            if pattern.startswith('(?', idx):
+                # Global flags like `(?i)` would apply to every joined pattern
+                flags_end = idx + 2
+                while pattern[flags_end:flags_end + 1].isalpha():
+                    flags_end += 1
+                if flags_end > idx + 2 and pattern[flags_end:flags_end + 1] == ')':
+                    return None
+
+            else:
+                stripped.append('(?:')
+                idx += 1
+                continue
+
+        stripped.append(char)
+        idx += 1
+
+    return ''.join(stripped)
+
+
+class TriggerMatcher:
+    """All of the actions for a channel and event_type, with a combined regex per field to quickly rule them out
+
+    Most events do not match any trigger. Instead of checking every pattern one at a time, all of the patterns on the
+    same field are joined into a single regex. If that does not match, no trigger with a pattern on that field can
+    fire and they are all skipped. The order of the actions is kept, so the first match still wins.
+    """
+
+    def __init__(self, actions):
+        """
+        Arguments:
+            actions {tuple} -- The actions in the order they should be checked. Each is a dict with the keys
+                               `callback` and `triggers`
+        """
+        self.actions = actions
+
+        patterns = {}  # field key -> (FieldPath, flags -> [pattern strings])
+        unfilterable = set()  # Field keys that have a pattern that cannot be joined with others
+        for action in actions:
+            for trigger in action['triggers']:
+                for field, regex_pattern in trigger['fields']:
+                    stripped = None
+                    if isinstance(regex_pattern.pattern, str) and not regex_pattern.flags & re.VERBOSE:
+                        stripped = _strip_groups(regex_pattern.pattern)
+                    if stripped is None:
+                        unfilterable.add(field.key)
+                        continue
+
+                    flag_patterns = patterns.setdefault(field.key, (field, {}))[1]
+                    flag_patterns.setdefault(regex_pattern.flags, []).append(stripped)
+
+        # Only worth it when a field has more then a single pattern
+        self.prefilters = []  # (FieldPath, [combined regexes])
+        for key, (field, flag_patterns) in patterns.items():
+            if key in unfilterable or sum(len(p) for p in flag_patterns.values()) < 2:
+                continue
+            try:
+                combined = [re.compile('|'.join('(?:{})'.format(p) for p in dict.fromkeys(pattern_strs)), flags)
+                            for flags, pattern_strs in flag_patterns.items()]
+            except re.error:
+                continue
+            self.prefilters.append((field, combined))
+
+        # For each action, the prefiltered field keys of each of its triggers
+        self._action_keys = []
+        filtered_keys = {field.key for field, _ in self.prefilters}
+        for action in actions:
+            self._action_keys.append([frozenset(field.key for field, _ in trigger['fields']) & filtered_keys
+                                      for trigger in action['triggers']])
+
+    def candidates(self, event_data, field_cache):
+        """Get the actions that could match the event
+
+        Arguments:
+            event_data {dict} -- The event data to get the fields from
+            field_cache {dict} -- Fields already pulled out of this event
+
+        Returns:
+            tuple/list -- The actions that still need to be checked, in order
+        """
+        failed_keys = set()
+        for field, combined in self.prefilters:
+            try:
+                value = resolve_field(field, event_data, field_cache)
+                if not any(regex.search(value) for regex in combined):
+                    failed_keys.add(field.key)
+            except Exception:
+                # Let the trigger itself deal with the field when it gets to it
+                continue
+
+        if not failed_keys:
+            return self.actions
+
+        return [action for action, trigger_keys in zip(self.actions, self._action_keys)
+                if any(trigger_key.isdisjoint(failed_keys) for trigger_key in trigger_keys)]
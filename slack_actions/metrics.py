@@ -0,0 +1,235 @@
+import time
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsSink:
+    """Receives the counters and timings, subclass it to send them somewhere else (statsd, logs, ...)
+
+    Labels are passed as a tuple of (name, value) pairs sorted by name. Both methods do nothing by default, so a sink
+    only needs to override the ones it uses. Exceptions raised by a sink are logged, they never stop an event
+    """
+
+    def incr(self, name, value, labels):
+        pass
+
+    def observe(self, name, seconds, labels):
+        pass
+
+
+class MemorySink(MetricsSink):
+    """Keeps the counters and a summary of the timings in memory, used by the `/slack/metrics` route"""
+
+    def __init__(self):
+        self._counters = defaultdict(float)  # (name, labels) -> value
+        self._timings = {}  # (name, labels) -> [count, total seconds, max seconds]
+        self._lock = threading.Lock()
+
+    def incr(self, name, value, labels):
+        with self._lock:
+            self._counters[(name, labels)] += value
+
+    def observe(self, name, seconds, labels):
+        with self._lock:
+            timing = self._timings.get((name, labels))
+            if timing is None:
+                self._timings[(name, labels)] = [1, seconds, seconds]
+            else:
+                timing[0] += 1
+                timing[1] += seconds
+                timing[2] = max(timing[2], seconds)
+
+    def snapshot(self):
+        """Copy of everything recorded so far
+
+        Returns:
+            dict -- `counters` and `timings`, each a list of dicts with the name, labels and values
+        """
+        with self._lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in self._counters.items()]
+            timings = [{'name': name, 'labels': dict(labels), 'count': count, 'total_seconds': total,
+                        'max_seconds': max_seconds}
+                       for (name, labels), (count, total, max_seconds) in self._timings.items()]
+
+        return {'counters': counters, 'timings': timings}
+
+
+class _NullTimer:
+    """Used when there are no sinks, so timing costs next to nothing"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Metrics:
+    """Per stage timings and counters of the events being processed
+
+    Nothing is recorded until a sink is added, `SlackController.setup(metrics=True)` adds a `MemorySink`
+    """
+
+    def __init__(self):
+        self.sinks = []
+        self._gauges = []  # Functions returning a list of (name, labels dict, value), read when rendering
+
+    def add_sink(self, sink):
+        """Send all the metrics to the sink
+
+        Arguments:
+            sink {MetricsSink} -- Where to send them
+        """
+        self.sinks.append(sink)
+
+    def add_gauges(self, collect):
+        """Add values that are read when the metrics are rendered, like the hit rates of the caches
+
+        Arguments:
+            collect {function} -- Returns a list of (name, labels dict, value)
+        """
+        self._gauges.append(collect)
+
+    @property
+    def enabled(self):
+        return bool(self.sinks)
+
+    def incr(self, name, value=1, **labels):
+        """Add to a counter
+
+        Arguments:
+            name {str} -- Name of the counter
+
+        Keyword Arguments:
+            value {int} -- How much to add (default: {1})
+            **labels -- Labels of the counter, like `event_type`
+        """
+        if not self.sinks:
+            return
+
+        labels = tuple(sorted(labels.items()))
+        for sink in self.sinks:
+            try:
+                sink.incr(name, value, labels)
+            except Exception:
+                logger.exception("Broke sending the counter {} to {}".format(name, type(sink).__name__))
+
+    def observe(self, name, seconds, **labels):
+        """Record how long something took
+
+        Arguments:
+            name {str} -- Name of the stage
+            seconds {float} -- How long it took
+            **labels -- Labels of the timing, like `event_type`
+        """
+        if not self.sinks:
+            return
+
+        labels = tuple(sorted(labels.items()))
+        for sink in self.sinks:
+            try:
+                sink.observe(name, seconds, labels)
+            except Exception:
+                logger.exception("Broke sending the timing {} to {}".format(name, type(sink).__name__))
+
+    def timer(self, name, **labels):
+        """Time the code in a `with` block
+
+        Arguments:
+            name {str} -- Name of the stage
+            **labels -- Labels of the timing, like `event_type`
+
+        Returns:
+            Context manager that records how long the block took
+        """
+        if not self.sinks:
+            return _NULL_TIMER
+
+        return _Timer(self, name, labels)
+
+    def gauges(self):
+        """Read the current value of all the gauges
+
+        Returns:
+            list -- (name, labels dict, value)
+        """
+        values = []
+        for collect in self._gauges:
+            try:
+                values.extend(collect())
+            except Exception:
+                logger.exception("Broke collecting the metrics gauges")
+
+        return values
+
+    def render_prometheus(self, namespace='slack_actions'):
+        """Render the metrics of the first `MemorySink` and the gauges in the prometheus text format
+
+        Keyword Arguments:
+            namespace {str} -- Added to the start of every metric name (default: {'slack_actions'})
+
+        Returns:
+            str/None -- The metrics, None if there is no `MemorySink`
+        """
+        sink = next((sink for sink in self.sinks if isinstance(sink, MemorySink)), None)
+        if sink is None:
+            return None
+
+        snapshot = sink.snapshot()
+        lines = []
+        samples = defaultdict(list)  # (metric name, type) -> samples, so each metric's samples are together
+        for counter in snapshot['counters']:
+            samples[(counter['name'] + '_total', 'counter')].append((counter['labels'], counter['value']))
+
+        for timing in snapshot['timings']:
+            name = timing['name'] + '_seconds'
+            samples[(name, 'summary')].append((timing['labels'], (timing['count'], timing['total_seconds'])))
+            samples[(name + '_max', 'gauge')].append((timing['labels'], timing['max_seconds']))
+
+        for name, labels, value in self.gauges():
+            samples[(name, 'gauge')].append((labels, value))
+
+        for (name, metric_type), metric_samples in sorted(samples.items()):
+            full_name = '{}_{}'.format(namespace, name)
+            lines.append('# TYPE {} {}'.format(full_name, metric_type))
+            for labels, value in metric_samples:
+                if metric_type == 'summary':
+                    count, total = value
+                    lines.append('{}_count{} {}'.format(full_name, _format_labels(labels), count))
+                    lines.append('{}_sum{} {}'.format(full_name, _format_labels(labels), repr(float(total))))
+                else:
+                    lines.append('{}{} {}'.format(full_name, _format_labels(labels), repr(float(value))))
+
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                           .replace('\n', '\\n'))
+                          for key, value in sorted(labels.items())) + '}'
@@ -0,0 +1,164 @@
+import time
+import heapq
+import logging
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# Only simple text messages can be merged into a single message
+MERGEABLE_KEYS = {'channel', 'method', 'text', 'thread_ts'}
+
+
+class OutboundDispatcher:
+    """Sends the messages returned by the callbacks using a pool of worker threads
+
+    Messages to the same channel are sent one at a time in the order they were submitted,
+    channels with messages waiting take turns so a busy channel does not hold up the others.
+    With a `coalesce_window`, text messages to the same channel/thread that are submitted within the window of each
+    other are sent as a single message.
+    """
+
+    def __init__(self, send, num_workers=4, coalesce_window=0):
+        """
+        Arguments:
+            send {function} -- Sends a message, takes the kwargs for the slack api call and returns the response
+
+        Keyword Arguments:
+            num_workers {int} -- Number of threads sending messages (default: {4})
+            coalesce_window {float} -- Seconds to wait for more messages to the same channel/thread to merge with,
+                                       0 to never merge (default: {0})
+        """
+        self._send = send
+        self.num_workers = num_workers
+        self.coalesce_window = coalesce_window
+
+        self._cond = threading.Condition()
+        self._channels = {}  # channel -> deque of (message, future, submitted_at)
+        self._ready = []  # heap of (time it can be sent, seq, channel), a channel is only in here once
+        self._scheduled = set()  # Channels in self._ready or being sent by a worker
+        self._seq = itertools.count()
+        self._workers = []
+        self._running = False
+
+    def start(self):
+        """Start the worker threads, does nothing if they are already running"""
+        if self._workers:
+            return
+
+        self._running = True
+        for idx in range(self.num_workers):
+            worker = threading.Thread(target=self._worker,
+                                      name='slack-actions-outbound-{}'.format(idx),
+                                      daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self, wait=True):
+        """Stop the worker threads once all of the messages have been sent
+
+        Keyword Arguments:
+            wait {bool} -- Block until all the workers have exited (default: {True})
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+        self._workers = []
+
+    def submit(self, message):
+        """Queue a message to be sent
+
+        Arguments:
+            message {dict} -- The kwargs for the slack api call, must have a `channel`
+
+        Returns:
+            concurrent.futures.Future -- Resolves to the response from slack
+        """
+        future = Future()
+        now = time.monotonic()
+        channel = message.get('channel')
+        with self._cond:
+            self._channels.setdefault(channel, deque()).append((message, future, now))
+            if channel not in self._scheduled:
+                self._schedule(channel, now + self.coalesce_window)
+
+        return future
+
+    def pending(self):
+        """Number of messages waiting to be sent"""
+        with self._cond:
+            return sum(len(messages) for messages in self._channels.values())
+
+    def _schedule(self, channel, send_at):
+        # Must hold self._cond
+        heapq.heappush(self._ready, (send_at, next(self._seq), channel))
+        self._scheduled.add(channel)
+        self._cond.notify()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    # When stopping, do not wait on the coalesce window
+                    if self._ready and (self._ready[0][0] <= now or not self._running):
+                        break
+                    if not self._running:
+                        return
+                    self._cond.wait(self._ready[0][0] - now if self._ready else None)
+
+                _, _, channel = heapq.heappop(self._ready)
+                batch = self._take_batch(channel)
+
+            self._send_batch(batch)
+
+            with self._cond:
+                messages = self._channels.get(channel)
+                if messages:
+                    # Go to the back of the line so other channels get a turn
+                    self._schedule(channel, max(time.monotonic(), messages[0][2] + self.coalesce_window))
+                else:
+                    self._channels.pop(channel, None)
+                    self._scheduled.discard(channel)
+
+    def _take_batch(self, channel):
+        """Get the next message of the channel, along with any that can be merged into it"""
+        messages = self._channels[channel]
+        batch = [messages.popleft()]
+        if self.coalesce_window <= 0 or not self._can_merge(batch[0][0], batch[0][0]):
+            return batch
+
+        while messages and self._can_merge(batch[0][0], messages[0][0]):
+            batch.append(messages.popleft())
+
+        return batch
+
+    def _can_merge(self, first, message):
+        return (message.get('method', 'chat.postMessage') == 'chat.postMessage' and
+                first.get('method', 'chat.postMessage') == 'chat.postMessage' and
+                set(message.keys()) <= MERGEABLE_KEYS and
+                set(first.keys()) <= MERGEABLE_KEYS and
+                message.get('thread_ts') == first.get('thread_ts'))
+
+    def _send_batch(self, batch):
+        message = batch[0][0]
+        if len(batch) > 1:
+            message = dict(message, text='\n'.join(item[0].get('text', '') for item in batch))
+
+        try:
+            slack_response = self._send(**message)
+        except Exception as e:
+            logger.exception("Broke sending a message to {}".format(message.get('channel')))
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        for _, future, _ in batch:
+            future.set_result(slack_response)
@@ -0,0 +1,133 @@
+"""Replay a capture of slack traffic against the app, with the slack web api stubbed out
+
+    python -m slack_actions.replay capture.log.gz --commands my_commands --speed 10
+
+The modules passed to `--commands` should register the commands (`trigger`/`add_commands`) without calling `setup()`,
+the setup is done here so the web api is never called. Channel names are not in the captured events, pass the
+`directory_snapshot` file of the bot with `--directory-snapshot` so commands added to a channel by name are triggered.
+"""
+import sys
+import time
+import logging
+import argparse
+import importlib
+
+from slack_actions.capture import read_capture
+from slack_actions.snapshot import DirectorySnapshot
+from slack_actions.testing import StubWebClient
+
+logger = logging.getLogger(__name__)
+
+# Captured headers that are not sent again
+SKIP_HEADERS = {'CONTENT-LENGTH', 'HOST'}
+
+
+def replay(path, speed=1.0, target='app', app=None):
+    """Send the requests from a capture through the app again
+
+    Arguments:
+        path {str} -- Path of the capture log file
+
+    Keyword Arguments:
+        speed {float} -- 1 for the original pacing, 10 for 10 times faster, None or 0 to go as fast as possible
+                         (default: {1.0})
+        target {str} -- `app` to send the requests to the falcon app, `controller` to skip the http layer and call
+                        `help_check`/`process_event` directly (default: {'app'})
+        app {falcon.API} -- The app to send the requests to, defaults to `slack_actions.app` (default: {None})
+
+    Returns:
+        dict -- Number of requests sent, errors, how long it took and the most it fell behind the original pacing
+    """
+    import falcon.testing
+    from slack_actions.api import event as event_resource
+    if app is None:
+        from slack_actions.api import app
+
+    def start_response(status, headers, exc_info=None):
+        if not status.startswith('200'):
+            raise RuntimeError("Got a {} from the app".format(status))
+
+    stats = {'requests': 0, 'errors': 0, 'max_late_seconds': 0.0}
+    first_received_at = None
+    start_time = time.monotonic()
+    for received_at, headers, body in read_capture(path):
+        if first_received_at is None:
+            first_received_at = received_at
+
+        if speed:
+            # Keep the same time between requests as when they were captured
+            delay = start_time + (received_at - first_received_at) / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Could not keep up with the original pacing
+                stats['max_late_seconds'] = max(stats['max_late_seconds'], -delay)
+
+        stats['requests'] += 1
+        try:
+            if target == 'app':
+                # The length is set from the body
+                headers = {key: value for key, value in headers.items() if key.upper() not in SKIP_HEADERS}
+                environ = falcon.testing.create_environ(path='/slack/event', method='POST', body=body,
+                                                        headers=headers)
+                b''.join(app(environ, start_response))
+            else:
+                event = event_resource.parse_body(body)
+                if event.get('type') != 'url_verification':
+                    event_resource.handle_event(event)
+        except Exception:
+            stats['errors'] += 1
+            logger.exception("Broke replaying request {}".format(stats['requests']))
+
+    stats['seconds'] = time.monotonic() - start_time
+    return stats
+
+
+def _unique_records(records):
+    if records is None:
+        return None
+
+    return [record for key, record in records.items() if key == record['id']]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('capture', help="Path of the capture log file")
+    parser.add_argument('--commands', nargs='*', default=[], help="Modules to import that register the commands")
+    parser.add_argument('--speed', type=float, default=1.0, help="1 for the original pacing, 10 for 10x faster")
+    parser.add_argument('--fast', action='store_true', help="Send the requests as fast as possible")
+    parser.add_argument('--target', choices=('app', 'controller'), default='app')
+    parser.add_argument('--api-latency', type=float, default=0, help="Seconds each stubbed slack api call takes")
+    parser.add_argument('--event-workers', type=int, default=0)
+    parser.add_argument('--directory-snapshot', help="Get the users and channels from this directory_snapshot file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    from slack_actions.slack_controller import slack_controller
+    users, channels = None, None
+    if args.directory_snapshot:
+        snapshot = DirectorySnapshot(args.directory_snapshot)
+        users = _unique_records(snapshot.load('users'))
+        channels = _unique_records(snapshot.load('channels'))
+
+    stub = StubWebClient(users=users, channels=channels, latency=args.api_latency, bot_user_id='UREPLAYBOT',
+                         file_channel='CREPLAY')
+    slack_controller.setup(slack_bot_token='xoxb-replay', web_client=stub, lazy_directory=not args.directory_snapshot,
+                           event_workers=args.event_workers, metrics=True)
+
+    sys.path.insert(0, '')
+    for module in args.commands:
+        importlib.import_module(module)
+
+    stats = replay(args.capture, speed=None if args.fast else args.speed, target=args.target)
+    if slack_controller.event_queue is not None:
+        slack_controller.event_queue.stop()
+
+    print("Replayed {requests} requests in {seconds:.2f}s, {errors} errors, at most {max_late_seconds:.3f}s behind"
+          .format(**stats))
+    print("Slack api calls: {}".format(stub.stats()))
+    print(slack_controller.metrics.render_prometheus())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import threading
+
+
+class _Flight:
+    """A call that is in progress"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class SingleFlight:
+    """Only one thread makes a call at a time, other threads that need the same thing wait for its result
+
+    Used when many events need the same thing from slack at once, like the `files.info` of a file that was just shared
+    """
+
+    def __init__(self):
+        self._flights = {}  # key -> _Flight
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """Call the function, unless another thread is already doing the call with the same key, then use its result
+
+        Arguments:
+            key -- What is being done, the same key means the same result
+            fn {function} -- Called with the args and kwargs to get the result
+
+        Returns:
+            tuple -- The result (None if another thread did the call and it raised) and True if it came from another
+                     thread
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = self._flights[key] = _Flight()
+
+        if not is_leader:
+            flight.done.wait()
+            return flight.result, True
+
+        try:
+            flight.result = fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+        return flight.result, False
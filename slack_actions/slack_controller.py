@@ -1,31 +1,121 @@
 import os
 import re
-import copy
+import json
+import asyncio
+import time
 import types
-import urllib
+import shutil
+import tempfile
+import functools
 import inspect
 import pathlib
 import logging
-from collections import defaultdict
+import threading
+from collections import OrderedDict, defaultdict
+from collections.abc import Mapping
+from concurrent.futures import Future, ThreadPoolExecutor
 from slackclient import SlackClient
+from slack_actions.batching import EventBatcher
+from slack_actions.capture import TrafficCapture
+from slack_actions.dedup import EventDeduplicator
+from slack_actions.directory import Directory, SqliteDirectoryStore
+from slack_actions.event_queue import EventQueue
+from slack_actions.execution import CallbackRunner, _callback_name
+from slack_actions.file_cache import FileCache
+from slack_actions.metrics import MemorySink, Metrics
+from slack_actions.matcher import FieldPath, TriggerMatcher, resolve_field
+from slack_actions.outbound import OutboundDispatcher
+from slack_actions.single_flight import SingleFlight
+from slack_actions.snapshot import DirectorySnapshot
+from slack_actions.web_client import SlackWebClient
 
 logger = logging.getLogger(__name__)
 
+# Bytes read at a time when downloading a file
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Returned by `parse_event` when the event matched a batched trigger, the callback gets it later with the rest
+BATCHED = object()
+
 
 class SlackApiError(Exception):
     pass
 
 
+class DownloadTooLargeError(Exception):
+    pass
+
+
 class SlackController:
 
     def __init__(self):
         self.triggers = defaultdict(lambda: defaultdict(list))
         self.helpers = defaultdict(list)
         self.channel_to_callbacks = defaultdict(list)  # Filled in by the user
+        # (channel name, event_type) -> TriggerMatcher. Built from the above using `_build_dispatch_table`
+        self._dispatch_table = {}
+        self._trigger_event_types = frozenset()
+        # id(channel actions) -> (channel actions, help message). Cleared when the commands or help messages change
+        self._help_payloads = {}
+        self._dispatch_lock = threading.Lock()
+
+        # All users and channels/dms the bot can see, accessible by name or id. Loaded in setup()
+        self.users = Directory(self._get_user_list, self._get_user_info)
+        self.channels = Directory(self._get_conversation_list, self._get_conversation_info)
+        self.directory_snapshot = None
+        # Used to look up users and channels at the same time as other calls to the slack api
+        self.lookup_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='slack-actions-lookup')
+
+        # file id -> (expires at, file data). Every upload sends a few events that all need `files.info`
+        self._file_info_cache = OrderedDict()
+        self._file_info_flights = SingleFlight()
+        self._file_info_lock = threading.Lock()
+        self.file_info_ttl = 60
+        self.file_info_max_size = 1000
+        self.file_info_hits = 0
+        self.file_info_misses = 0
+
+        # Timings and counters of each stage of processing an event. Nothing is recorded until it has a sink
+        self.metrics = Metrics()
+        self.metrics.add_gauges(self._cache_gauges)
+
+        # Runs the callbacks using the `execution` option of their trigger (timeouts, thread pools, circuit breakers)
+        self.callback_runner = CallbackRunner(metrics=self.metrics)
+        self.metrics.add_gauges(self.callback_runner.gauges)
+        # Buffers the events of the triggers with a `batch` option, by callback
+        self.batcher = EventBatcher(self._flush_batch)
 
         # Defaults for the help message
         self.help_message_regex = None  # The user can set their own, or it will default to whats in the setup()
 
+        # Url of the slack web api, from the setup. Used when the web_client passed to the setup does not have one
+        self.slack_api_url = 'https://slack.com/api/'
+        # Used by the asgi app to call the slack api without blocking, created when first needed
+        self.async_client = None
+        # The event loop of the asgi app, set by `process_event_async`. `async def` callbacks that are run in another
+        # thread (like a batch) are run on it, so they can use `async_api_call`
+        self.event_loop = None
+
+        # When set, the messages returned by the callbacks are queued and sent by its workers. Created in setup()
+        self.outbound = None
+
+        # Used by download_async(). Created in setup()
+        self.download_executor = None
+        # Default max number of bytes download() will save, None for no limit
+        self.download_max_size = None
+        # When set, files downloaded with a cache_key are kept on disk so they are only downloaded once
+        self.file_cache = None
+
+        # When set, every request from slack is saved to a log that can be replayed. Created in setup()
+        self.capture = None
+
+        # When set, events are acknowledged right away and processed by the workers. Created in setup()
+        self.event_queue = None
+        # When set, events are received over a websocket instead of being posted to the app. Created in setup()
+        self.socket_mode = None
+        # Used to skip events that slack sent again. Set to None to process every delivery
+        self.deduplicator = EventDeduplicator()
+
     def add_commands(self, channel_commands):
         """Add the commands to a channel
 
@@ -83,7 +173,75 @@ class SlackController:
 
             self.channel_to_callbacks[channel].extend(channel_callbacks)
 
-    def setup(self, slack_bot_token=None):
+        self._build_dispatch_table()
+
+    def setup(self, slack_bot_token=None, event_workers=0, event_queue_size=1000, dedup_ttl=600,
+              dedup_max_size=10000, directory_snapshot=None, lazy_directory=False, directory_store=None,
+              user_fields=None, channel_fields=None, slack_api_url='https://slack.com/api/', outbound_workers=0,
+              outbound_coalesce_window=0, download_workers=4, download_max_size=None, file_cache=None,
+              file_cache_max_size=1024 ** 3, file_info_ttl=60, metrics=False, web_client=None, capture_path=None,
+              capture_max_bytes=100 * 1024 ** 2, capture_backup_count=5, callback_workers=8,
+              process_workers=0, socket_mode=False, slack_app_token=None):
+        """Connect to slack and load the data needed to process events
+
+        Keyword Arguments:
+            slack_bot_token {str} -- Used if the env var `SLACK_BOT_TOKEN` is not set (default: {None})
+            event_workers {int} -- If more then 0, respond to slack right away and process the events
+                                   using this many worker threads (default: {0})
+            event_queue_size {int} -- Max number of events waiting for a worker (default: {1000})
+            dedup_ttl {int} -- Seconds to remember an event so retries from slack are skipped,
+                               0 to process every delivery (default: {600})
+            dedup_max_size {int} -- Max number of events to remember (default: {10000})
+            directory_snapshot {str} -- Path to a sqlite file to save the users and channels to. If it exists they are
+                                        loaded from it and refreshed from slack in the background (default: {None})
+            lazy_directory {bool} -- Do not load all the users and channels, only get them from slack when they are
+                                     needed (default: {False})
+            directory_store {str/function} -- Where to keep the users and channels. A path to a sqlite file shared
+                                              by all the workers on the host, or a function that takes the directory
+                                              name (`users`/`channels`) and returns a store. Defaults to in memory in
+                                              each worker (default: {None})
+            user_fields {list} -- Only keep these fields of each user to save memory, the rest are fetched from
+                                  slack when used. `slack_actions.directory.USER_FIELDS` is a good start
+                                  (default: {None})
+            channel_fields {list} -- Same as user_fields, but for channels. See `slack_actions.directory.CHANNEL_FIELDS`
+                                     (default: {None})
+            slack_api_url {str} -- Url of the slack web api, can be changed to point to a test server
+                                   (default: {'https://slack.com/api/'})
+            outbound_workers {int} -- If more then 0, the messages returned by the callbacks are queued and sent by
+                                      this many worker threads, in order for each channel (default: {0})
+            outbound_coalesce_window {float} -- Seconds to wait for more text messages to the same channel/thread to
+                                                merge into a single message, 0 to never merge (default: {0})
+            download_workers {int} -- Number of threads used by `download_async` (default: {4})
+            download_max_size {int} -- Default max number of bytes `download` will save, bigger files are not
+                                       saved. None for no limit (default: {None})
+            file_cache {str} -- Directory to keep downloaded files in, so a file shared more then once (or that
+                                triggers more then one callback) is only downloaded once. See `download_file`
+                                (default: {None})
+            file_cache_max_size {int} -- Max number of bytes kept in the file_cache, the least recently used files
+                                         are removed first (default: {1GB})
+            file_info_ttl {int} -- Seconds to cache the responses of `files.info` for, 0 to not cache them
+                                   (default: {60})
+            metrics {bool} -- Record the timings and counters of each stage in memory, they can be seen at
+                              `/slack/metrics` in the prometheus text format. Other sinks can be added with
+                              `slack_controller.metrics.add_sink` (default: {False})
+            web_client {SlackWebClient} -- Use this to call the slack api instead of creating one, anything with the
+                                           same `api_call` works, like a stub for testing (default: {None})
+            capture_path {str} -- Save every request from slack to this gzip compressed log, it can be replayed with
+                                  `python -m slack_actions.replay` (default: {None})
+            capture_max_bytes {int} -- Rotate the capture log once it is this big (default: {100MB})
+            capture_backup_count {int} -- Number of rotated capture logs to keep (default: {5})
+            callback_workers {int} -- Number of threads shared by the callbacks whose trigger has an `execution`
+                                      option with a timeout or `'executor': 'shared'` (default: {8})
+            process_workers {int} -- Number of worker processes for the callbacks whose trigger has
+                                     `'executor': 'process'`, 0 for one for each cpu. They are started now if this is
+                                     more then 0 or a trigger already uses them (default: {0})
+            socket_mode {bool} -- Get the events from slack over a websocket instead of the `/slack/event` route,
+                                  so the app does not need a public url (default: {False})
+            slack_app_token {str} -- App level token used by socket_mode, used if the env var `SLACK_APP_TOKEN` is
+                                     not set (default: {None})
+        """
+        setup_start = time.monotonic()
+
         # Do not have this in __init__ because this is not needed when running tests
         self.SLACK_BOT_TOKEN = os.environ.get('SLACK_BOT_TOKEN')
         if self.SLACK_BOT_TOKEN is None:
@@ -93,8 +251,24 @@ class SlackController:
             raise ValueError("Missing SLACK_BOT_TOKEN")
 
         self.slack_client = SlackClient(self.SLACK_BOT_TOKEN)
-        self.channels = self._get_conversation_list()  # Includes groups and channels
-        self.users = self._get_user_list()
+        self.slack_api_url = slack_api_url
+        # Used for all calls to the slack api, pools connections and stays under the rate limits
+        if web_client is None:
+            web_client = SlackWebClient(self.SLACK_BOT_TOKEN, base_url=slack_api_url)
+        self.web_client = web_client
+
+        if isinstance(directory_store, str):
+            directory_store = functools.partial(SqliteDirectoryStore, directory_store)
+        if directory_store is not None:
+            self.users.store = directory_store('users')
+            self.channels.store = directory_store('channels')
+
+        if user_fields is not None:
+            self.users.use_compact_records(user_fields, name='UserRecord')
+        if channel_fields is not None:
+            self.channels.use_compact_records(channel_fields, name='ChannelRecord')
+
+        self._load_directories(directory_snapshot, lazy_directory)
 
         self.BOT_USER_ID = self._get_bot_user_id()
         self.BOT_ID = self._get_bot_id(self.BOT_USER_ID)
@@ -104,8 +278,112 @@ class SlackController:
             self.help_message_regex = re.compile('^(?:{bot_name} )?help$'.format(bot_name=self.BOT_NAME),
                                                  flags=re.IGNORECASE)
 
+        if dedup_ttl > 0:
+            self.deduplicator = EventDeduplicator(ttl=dedup_ttl, max_size=dedup_max_size)
+        else:
+            self.deduplicator = None
+
+        if outbound_workers > 0 and self.outbound is None:
+            self.outbound = OutboundDispatcher(self._send_message, num_workers=outbound_workers,
+                                               coalesce_window=outbound_coalesce_window)
+            self.outbound.start()
+
+        self.download_max_size = download_max_size
+        self.file_info_ttl = file_info_ttl
+        if metrics and not any(isinstance(sink, MemorySink) for sink in self.metrics.sinks):
+            self.metrics.add_sink(MemorySink())
+        if file_cache is not None:
+            self.file_cache = FileCache(file_cache, max_size=file_cache_max_size)
+        if self.download_executor is None:
+            self.download_executor = ThreadPoolExecutor(max_workers=download_workers,
+                                                        thread_name_prefix='slack-actions-download')
+
+        self.callback_runner.shared_workers = callback_workers
+        self.callback_runner.process_workers = process_workers or None
+        self.callback_runner.process_initializer = _init_process_worker
+        self.callback_runner.process_initargs = (self.SLACK_BOT_TOKEN,
+                                                 self.get_api_url(),
+                                                 download_max_size)
+        if process_workers > 0 or self._uses_process_executor():
+            self.callback_runner.warm_process_pool()
+
+        if capture_path is not None and self.capture is None:
+            self.capture = TrafficCapture(capture_path, max_bytes=capture_max_bytes, backup_count=capture_backup_count)
+
+        if event_workers > 0 and self.event_queue is None:
+            self.event_queue = EventQueue(num_workers=event_workers, max_size=event_queue_size)
+            self.event_queue.start()
+
+        if socket_mode and self.socket_mode is None:
+            app_token = os.environ.get('SLACK_APP_TOKEN') or slack_app_token
+            if not app_token:
+                raise ValueError("Missing SLACK_APP_TOKEN, needed for socket_mode")
+
+            # Only imported when needed since it imports the falcon app
+            from slack_actions.socket_mode import SocketModeClient
+            self.socket_mode = SocketModeClient(app_token)
+            self.socket_mode.start()
+
+        self.setup_seconds = time.monotonic() - setup_start
+        logger.info("Setup done in {:.3f}s".format(self.setup_seconds))
+
+    def _load_directories(self, directory_snapshot, lazy_directory):
+        """Load self.users and self.channels
+
+        Arguments:
+            directory_snapshot {str} -- Path to the snapshot file, or None to not use one
+            lazy_directory {bool} -- Do not load anything, they are filled in as they are needed
+        """
+        if lazy_directory:
+            return
+
+        if directory_snapshot is not None:
+            self.directory_snapshot = DirectorySnapshot(directory_snapshot)
+
+        if len(self.channels) and len(self.users):
+            # Using a store that another worker already filled, only one of them needs to refresh it
+            threading.Thread(target=self._revalidate_directories, kwargs={'force': False},
+                             name='slack-actions-directory-refresh', daemon=True).start()
+            return
+
+        if self.directory_snapshot is None:
+            self.channels.refresh()  # Includes groups and channels
+            self.users.refresh()
+            return
+
+        channels = self.directory_snapshot.load('channels')
+        users = self.directory_snapshot.load('users')
+        if channels is None or users is None:
+            # Nothing saved yet, so need to wait on slack
+            self._refresh_directories()
+            return
+
+        self.channels.replace(channels)
+        self.users.replace(users)
+        threading.Thread(target=self._revalidate_directories, name='slack-actions-directory-refresh',
+                         daemon=True).start()
+
+    def _refresh_directories(self, force=True):
+        """Refresh self.users and self.channels from slack and save them to the snapshot
+
+        Keyword Arguments:
+            force {bool} -- Refresh even if it was just done by another worker sharing the store (default: {True})
+        """
+        self.channels.refresh(force=force)  # Includes groups and channels
+        self.users.refresh(force=force)
+        if self.directory_snapshot is not None:
+            self.directory_snapshot.save('channels', self.channels.unique_records())
+            self.directory_snapshot.save('users', self.users.unique_records())
+
+    def _revalidate_directories(self, force=True):
+        """Run in the background after loading the users and channels from the snapshot or a shared store"""
+        try:
+            self._refresh_directories(force=force)
+        except Exception:
+            logger.exception("Failed to refresh the users and channels")
+
     def _get_bot_user_id(self):
-        slack_response = self.slack_client.api_call('auth.test')
+        slack_response = self.api_call('auth.test')
         if slack_response['ok'] is False:
             error_message = "{error} {content}".format(error=slack_response['error'],
                                                        content=slack_response.get('needed', ''))
@@ -114,7 +392,7 @@ class SlackController:
         return slack_response['user_id']
 
     def _get_bot_id(self, bot_user_id):
-        slack_response = self.slack_client.api_call('users.info', user=bot_user_id)
+        slack_response = self.api_call('users.info', user=bot_user_id)
         if slack_response['ok'] is False:
             error_message = "{error} {content}".format(error=slack_response['error'],
                                                        content=slack_response.get('needed', ''))
@@ -134,12 +412,25 @@ class SlackController:
         Returns:
             bool -- False if the help message should not be triggered, True if it was
         """
-        if event_type != 'message' or not re.match(self.help_message_regex,
-                                                   full_data['event']['text']):
+        if not self.is_help_message(full_data, event_type):
             return False
 
         all_channel_actions = self.get_all_channel_actions(full_data['sa_channel'].get('name', '__direct_message__'))
         self.help_action(all_channel_actions, full_data)
+        return True
+
+    def is_help_message(self, full_data, event_type):
+        """Check if the event is asking for the help message
+
+        Arguments:
+            full_data {dict} -- The event from the slack api
+            event_type {str} -- Event type of the event that was sent by slack
+
+        Returns:
+            bool -- True if it is the help message
+        """
+        return (event_type == 'message' and
+                re.match(self.help_message_regex, full_data['event'].get('text') or '') is not None)
 
     def help_action(self, all_channel_actions, full_data):
         """Get all of the help commands form the channel
@@ -151,30 +442,51 @@ class SlackController:
         Returns:
             dict -- The response to send to the slack api
         """
-        message_data = {'channel': full_data['sa_channel']['id'],
-                        'method': 'chat.postEphemeral',
-                        'user': full_data['sa_user']['id'],
-                        'text': 'Here are all the commands available in this channel',
-                        'attachments': [],
-                        }
+        message_data = dict(self._get_help_payload(all_channel_actions),
+                            channel=full_data['sa_channel']['id'],
+                            user=full_data['sa_user']['id'])
+
+        # Post to slack
+        self.send_message(message_data, wait=False)
+
+    def _get_help_payload(self, all_channel_actions):
+        """The help message for the actions, without who it is sent to
+
+        Built once for each set of actions and then reused until the commands, triggers or help messages change
+
+        Arguments:
+            all_channel_actions {tuple} -- All of the commands in the channel
+
+        Returns:
+            dict -- The message to send to the slack api, the attachments are already json encoded
+        """
+        # The actions from `get_all_channel_actions` are the same tuple until the commands change
+        can_cache = isinstance(all_channel_actions, tuple)
+        cache_key = id(all_channel_actions)
+        cached = self._help_payloads.get(cache_key)
+        # Make sure it is the same actions and not a new tuple that got the id of one that was removed
+        if cached is not None and cached[0] is all_channel_actions:
+            return cached[1]
 
         attachment_defaults = {'mrkdwn_in': ['text', 'pretext'],
                                }
 
+        attachments = []
         for action in all_channel_actions:
             for helper in self.helpers.get(action['callback'], []):
                 helper_attacment = attachment_defaults.copy()
                 helper_attacment.update(helper)
-                message_data['attachments'].append(helper_attacment)
+                attachments.append(helper_attacment)
 
-        # Post to slack
-        slack_response = self.slack_client.api_call(**message_data)
-        if slack_response['ok'] is False:
-            error_message = "Slack Web API Response: {error} {content} {response_metadata}"\
-                            .format(error=slack_response['error'],
-                                    content=slack_response.get('needed', ''),
-                                    metadata=slack_response.get('response_metadata', ''))
-            logger.error(error_message)
+        payload = {'method': 'chat.postEphemeral',
+                   'text': 'Here are all the commands available in this channel',
+                   'attachments': json.dumps(attachments),
+                   }
+        if can_cache:
+            # Keep a reference to the actions so their id is not reused while cached
+            self._help_payloads[cache_key] = (all_channel_actions, payload)
+
+        return payload
 
     def _get_conversation_list(self):
         """Get all channel data and save by name and id
@@ -189,10 +501,10 @@ class SlackController:
         while next_cursor:
             if next_cursor == 'start':  # To get the first page
                 next_cursor = None
-            slack_response = self.slack_client.api_call('conversations.list',
-                                                        limit=1000,
-                                                        cursor=next_cursor,
-                                                        types='public_channel,private_channel,mpim,im')
+            slack_response = self.api_call('conversations.list',
+                                           limit=1000,
+                                           cursor=next_cursor,
+                                           types='public_channel,private_channel,mpim,im')
             if slack_response['ok'] is False:
                 error_message = "{error} {content}".format(error=slack_response['error'],
                                                            content=slack_response.get('needed', ''))
@@ -222,7 +534,7 @@ class SlackController:
         while next_cursor:
             if next_cursor == 'start':  # To get the first page
                 next_cursor = None
-            slack_response = self.slack_client.api_call('users.list', limit=1000, cursor=next_cursor)
+            slack_response = self.api_call('users.list', limit=1000, cursor=next_cursor)
             if slack_response['ok'] is False:
                 error_message = "{error} {content}".format(error=slack_response['error'],
                                                            content=slack_response.get('needed', ''))
@@ -237,10 +549,48 @@ class SlackController:
 
         return users
 
+    def _get_user_info(self, user_id):
+        """Get a single user from the slack api
+
+        Arguments:
+            user_id {str} -- Id of the user
+
+        Returns:
+            dict/None -- The user data, None if the user does not exist
+        """
+        slack_response = self.api_call('users.info', user=user_id)
+        if slack_response['ok'] is False:
+            if slack_response['error'] == 'user_not_found':
+                return None
+            error_message = "{error} {content}".format(error=slack_response['error'],
+                                                       content=slack_response.get('needed', ''))
+            raise SlackApiError(error_message)
+
+        return slack_response['user']
+
+    def _get_conversation_info(self, channel_id):
+        """Get a single channel/dm from the slack api
+
+        Arguments:
+            channel_id {str} -- Id of the channel
+
+        Returns:
+            dict/None -- The channel data, None if the channel does not exist or the app does not have access to it
+        """
+        slack_response = self.api_call('conversations.info', channel=channel_id)
+        if slack_response['ok'] is False:
+            if slack_response['error'] == 'channel_not_found':
+                return None
+            error_message = "{error} {content}".format(error=slack_response['error'],
+                                                       content=slack_response.get('needed', ''))
+            raise SlackApiError(error_message)
+
+        return slack_response['channel']
+
     def get_user(self, key):
         """Get the user data
 
-        Try and get the user from self.users, if it can't then refresh the user list and try again
+        Try and get the user from self.users, if it is not there ask the slack api for it
 
         Arguments:
             key {str} -- Either the name or id of the user
@@ -248,21 +598,12 @@ class SlackController:
         Returns:
             dict/None -- The data about the user from the slack api
         """
-        for _ in range(2):
-            user = self.users.get(key)
-            if user is None:
-                # Update user list from slack api and try and get the user again
-                self.users = self._get_user_list()
-            else:
-                # We found the user, so no need to loop again
-                break
-
-        return user
+        return self.users.lookup(key)
 
     def get_channel(self, key):
         """Get the channel data
 
-        Try and get the channel from self.channels, if it can't then refresh the channel list and try again
+        Try and get the channel from self.channels, if it is not there ask the slack api for it
 
         Arguments:
             key {str} -- Either the name or id of the channel
@@ -270,20 +611,94 @@ class SlackController:
         Returns:
             dict/None -- The data about the channel from the slack api
         """
-        for _ in range(2):
-            channel = self.channels.get(key)
-            if channel is None:
-                # Update channel list from slack api and try and get the channel again
-                self.channels = self._get_conversation_list()
-            else:
-                # We found the channel, so no need to loop again
-                break
-
+        channel = self.channels.lookup(key)
         if not channel:
             logger.warning('The app does not have access to the channel {}'.format(key))
 
         return channel
 
+    def get_user_future(self, key):
+        """Same as `get_user`, but if the user is not known yet it is looked up in the background
+
+        Arguments:
+            key {str} -- Either the name or id of the user
+
+        Returns:
+            concurrent.futures.Future -- Resolves to the user data
+        """
+        if key in self.users:
+            # Quicker to get it now then to hand it off to another thread
+            future = Future()
+            future.set_result(self.get_user(key))
+            return future
+
+        return self.lookup_executor.submit(self.get_user, key)
+
+    def get_file_info(self, file_id):
+        """Get the file data from `files.info`
+
+        Responses are cached for `file_info_ttl` seconds, and if the same file is already being looked up this waits
+        for it instead of calling the slack api again
+
+        Arguments:
+            file_id {str} -- The id of the file
+
+        Returns:
+            dict/None -- The data about the file from the slack api
+        """
+        with self._file_info_lock:
+            cached = self._file_info_cache.get(file_id)
+            if cached is not None and cached[0] > time.monotonic():
+                self.file_info_hits += 1
+                return cached[1]
+
+            self.file_info_misses += 1
+
+        file_info, _ = self._file_info_flights.do(file_id, self._fetch_file_info, file_id)
+        return file_info
+
+    def _fetch_file_info(self, file_id):
+        file_data = self.api_call('files.info', file=file_id)
+        if file_data['ok'] is False:
+            self._log_response_error(file_data)
+            return None
+
+        if self.file_info_ttl > 0:
+            with self._file_info_lock:
+                self._file_info_cache.pop(file_id, None)
+                self._file_info_cache[file_id] = (time.monotonic() + self.file_info_ttl, file_data['file'])
+                while len(self._file_info_cache) > self.file_info_max_size:
+                    self._file_info_cache.popitem(last=False)
+
+        return file_data['file']
+
+    def update_directory(self, full_data, event_type):
+        """Keep self.users and self.channels up to date using the events slack sends when they change
+
+        Arguments:
+            full_data {dict} -- The event from the slack api
+            event_type {str} -- Event type of the event that was sent by slack
+        """
+        if event_type in ['user_change', 'team_join']:
+            self.users.add(full_data['event']['user'])
+
+        elif event_type in ['channel_created', 'channel_rename']:
+            channel = full_data['event']['channel']
+            old_channel = self.channels.get(channel['id'])
+            if old_channel is not None:
+                # The event only has some of the channel data
+                channel = dict(old_channel, **channel)
+            self.channels.add(channel)
+
+        elif event_type == 'channel_deleted':
+            self.channels.remove(full_data['event']['channel'])
+
+        elif event_type == 'member_joined_channel' and full_data['event']['user'] == self.BOT_USER_ID:
+            # The bot now has access to the channel
+            channel = self._get_conversation_info(full_data['event']['channel'])
+            if channel is not None:
+                self.channels.add(channel)
+
     def get_all_channel_callbacks(self, channel_name):
         """Get all the callbacks in the given channel
 
@@ -293,15 +708,68 @@ class SlackController:
         Returns:
             list -- list of all of the callbacks in the given channel
         """
-        all_channel_callbacks = self.channel_to_callbacks.get(channel_name, [])
+        all_channel_callbacks = list(self.channel_to_callbacks.get(channel_name, []))
         # All callbacks that are in ALL channels. Make the list unique.
         # If not, if a command is in __all__ and another channel it will display the help twice
+        seen_callbacks = set(all_channel_callbacks)
         for callback in self.channel_to_callbacks.get('__all__', []):
-            if callback not in all_channel_callbacks:
+            if callback not in seen_callbacks:
+                seen_callbacks.add(callback)
                 all_channel_callbacks.append(callback)
 
         return all_channel_callbacks
 
+    def _build_dispatch_table(self):
+        """Compile the commands and triggers into the lookup used by `get_all_channel_actions`
+
+        Needs to be called any time the commands or triggers change.
+        The new table replaces the old one in a single assignment so events being processed never see a partial table
+        """
+        with self._dispatch_lock:
+            table = {}
+            for channel_name in list(self.channel_to_callbacks.keys()):
+                all_channel_callbacks = self.get_all_channel_callbacks(channel_name)
+
+                help_triggers = defaultdict(list)  # Used by the help message, has the triggers of all event_types
+                for event_type, actions in list(self.triggers.items()):
+                    channel_actions = []
+                    for callback in all_channel_callbacks:
+                        if callback in actions:
+                            triggers = tuple(actions[callback])
+                            channel_actions.append({'callback': callback, 'triggers': triggers})
+                            help_triggers[callback].extend(triggers)
+
+                    table[(channel_name, event_type)] = TriggerMatcher(tuple(channel_actions))
+
+                table[(channel_name, None)] = TriggerMatcher(tuple({'callback': callback,
+                                                                    'triggers': tuple(help_triggers[callback])}
+                                                                   for callback in all_channel_callbacks
+                                                                   if callback in help_triggers))
+
+            self._dispatch_table = table
+            self._help_payloads = {}
+            # Event types that can trigger a command in any channel
+            self._trigger_event_types = frozenset(event_type for (_, event_type), channel_matcher in table.items()
+                                                  if event_type is not None and channel_matcher.actions)
+
+    def _uses_process_executor(self):
+        """Check if any trigger runs its callback in the process pool"""
+        return any(trigger['execution'].get('executor') == 'process'
+                   for actions in list(self.triggers.values())
+                   for triggers in list(actions.values())
+                   for trigger in triggers)
+
+    def has_triggers(self, event_type):
+        """Check if any command could be triggered by the event_type
+
+        Arguments:
+            event_type {str} -- Event type of the event that was sent by slack
+
+        Returns:
+            bool -- False if there is no need to process events of this type
+        """
+        return event_type in self._trigger_event_types
+
     def get_all_channel_actions(self, channel_name, event_type=None):
         """Get all actions for the given channel, filter by an event_type if passed in
 
@@ -315,24 +783,31 @@ class SlackController:
             event_type {str} -- Event type of the event that was sent by slack
 
         Returns:
-            list -- list of the channel actions based on the inputs
+            tuple -- the channel actions based on the inputs, in the order they should be checked
         """
-        channel_actions = []
+        channel_matcher = self._get_channel_matcher(channel_name, event_type)
+        if channel_matcher is None:
+            return ()
 
-        if event_type is not None:
-            actions = self.triggers[event_type]
-        else:
-            actions = {}
-            for triggers in self.triggers.values():
-                actions.update(triggers)
+        return channel_matcher.actions
+
+    def _get_channel_matcher(self, channel_name, event_type):
+        """Get the compiled actions for the channel and event_type
+
+        Arguments:
+            channel_name {str} -- Name of the channel to look for actions in
+            event_type {str} -- Event type of the event that was sent by slack, None for the help message
 
-        all_channel_callbacks = self.get_all_channel_callbacks(channel_name)
-        for callback in all_channel_callbacks:
-            if callback in actions:
-                triggers = actions[callback]
-                channel_actions.append({'callback': callback, 'triggers': triggers})
+        Returns:
+            TriggerMatcher/None -- None if there are no actions for the event_type in the channel
+        """
+        dispatch_table = self._dispatch_table
+        channel_matcher = dispatch_table.get((channel_name, event_type))
+        if channel_matcher is None:
+            # Channel does not have any of its own commands, so only the ones in all channels
+            channel_matcher = dispatch_table.get(('__all__', event_type))
 
-        return channel_actions
+        return channel_matcher
 
     def process_event(self, full_data, event_type):
         """See if there are any commands for the event_type that will be triggered
@@ -346,34 +821,235 @@ class SlackController:
             return
 
         try:
-            all_channel_event_actions = self.get_all_channel_actions(
-                full_data['sa_channel'].get('name', '__direct_message__'), event_type=event_type)
-            # Default response
-            response = {'channel': full_data['sa_channel']['id'],
-                        'method': 'chat.postMessage',
-                        }
-
             callback_output = None
+            field_cache = {}  # Each field is only pulled out of the event once for all of the triggers
+            with self.metrics.timer('get_actions', event_type=event_type):
+                # Skips the commands that cannot match
+                event_actions = self._get_event_actions(full_data, event_type, field_cache)
+
             # Loop over all triggers for a given command
-            for action in all_channel_event_actions:
-                callback_output = self.parse_event(full_data, action['callback'], action['triggers'])
+            for action in event_actions:
+                callback_output = self.parse_event(full_data, action['callback'], action['triggers'],
+                                                   field_cache=field_cache, event_type=event_type)
+                if callback_output is BATCHED:
+                    # Nothing to send until the batch is flushed
+                    callback_output = None
+                    break
+
                 if callback_output is not None:
                     break
 
             if callback_output is not None:
                 # Found a trigger that worked
-                response.update(callback_output)
-                slack_response = self.slack_client.api_call(**response)
-                if slack_response['ok'] is False:
-                    error_message = "Slack Web API Response: {error} {content} {metadata}"\
-                                    .format(error=slack_response['error'],
-                                            content=slack_response.get('needed', ''),
-                                            metadata=slack_response.get('response_metadata', ''))
-                    logger.error(error_message)
+                self.send_message(self._build_response(full_data, callback_output), wait=False)
+
+        except Exception:
+            self.metrics.incr('errors', stage='process_event', event_type=event_type)
+            logger.exception("Broke trying to trigger a command")
+
+    async def process_event_async(self, full_data, event_type):
+        """Same as `process_event`, but `async def` callbacks are awaited and the response is sent without blocking
+
+        Callbacks that are not coroutines are run in the event loop's executor
+
+        Arguments:
+            full_data {dict} -- The event from the slack api as well as user and channel data
+            event_type {str} -- Event type of the event that was sent by slack
+        """
+        self.event_loop = asyncio.get_running_loop()
+        if not full_data['sa_channel']:
+            # Does not have access to channel
+            return
+
+        try:
+            callback_output = None
+            field_cache = {}
+            with self.metrics.timer('get_actions', event_type=event_type):
+                event_actions = self._get_event_actions(full_data, event_type, field_cache)
+
+            for action in event_actions:
+                trigger, call = self._match_action(full_data, action['callback'], action['triggers'],
+                                                   field_cache=field_cache, event_type=event_type, awaitable=True)
+                if call is None:
+                    continue
+
+                if call is BATCHED:
+                    break
+
+                with self.metrics.timer('callback', event_type=event_type, callback=_callback_name(action['callback'])):
+                    callback_output = await self.callback_runner.run_async(action['callback'], trigger['execution'],
+                                                                           call)
+
+                if callback_output is not None:
+                    break
+
+            if callback_output is not None:
+                response = self._build_response(full_data, callback_output)
+                if self.outbound is not None:
+                    # Keeps the order of the messages to each channel and merges them the same as `process_event`
+                    self.send_message(response, wait=False)
+                else:
+                    slack_response = await self.async_api_call(**response)
+                    self._log_response_error(slack_response)
 
         except Exception:
+            self.metrics.incr('errors', stage='process_event', event_type=event_type)
             logger.exception("Broke trying to trigger a command")
 
+    def callback_states(self):
+        """How the callbacks with an `execution` option on their trigger are doing
+
+        Returns:
+            dict -- callback name -> number of calls, errors, timeouts, calls skipped by the circuit breaker, the
+                    state of the circuit breaker (`closed`, `open`, `half_open` or None) and failures in a row
+        """
+        return self.callback_runner.states()
+
+    def send_message(self, message_data, wait=True):
+        """Send a message (or any other slack api call) in the same order as the responses of the callbacks
+
+        Arguments:
+            message_data {dict} -- The kwargs for the slack api call, `method` defaults to `chat.postMessage`
+
+        Keyword Arguments:
+            wait {bool} -- Wait for it to be sent and return the response, needed to get things like the `ts` of the
+                           message. Otherwise it is queued if `outbound_workers` was set in setup() (default: {True})
+
+        Returns:
+            dict/concurrent.futures.Future/None -- The response from slack if waiting, otherwise a future for it if
+                                                   it was queued
+        """
+        message_data = dict(message_data)
+        message_data.setdefault('method', 'chat.postMessage')
+        if self.outbound is None:
+            slack_response = self._send_message(**message_data)
+            return slack_response if wait else None
+
+        future = self.outbound.submit(message_data)
+        return future.result() if wait else future
+
+    def _send_message(self, **message_data):
+        slack_response = self.api_call(**message_data)
+        self._log_response_error(slack_response)
+        return slack_response
+
+    def _cache_gauges(self):
+        """Hit and miss counts of the caches, for the metrics"""
+        cache_stats = {'users': self.users.stats(),
+                       'channels': self.channels.stats(),
+                       'files_info': {'hits': self.file_info_hits, 'misses': self.file_info_misses},
+                       }
+        if self.file_cache is not None:
+            cache_stats['files'] = self.file_cache.stats()
+        if self.deduplicator is not None:
+            cache_stats['dedup'] = self.deduplicator.stats()
+
+        gauges = []
+        for cache, stats in cache_stats.items():
+            gauges.append(('cache_hits', {'cache': cache}, stats['hits']))
+            gauges.append(('cache_misses', {'cache': cache}, stats['misses']))
+
+        return gauges
+
+    def api_call(self, method, **kwargs):
+        """Call the slack web api
+
+        Calls are delayed to stay under slacks rate limits and retried if slack says to slow down.
+        Use this instead of `self.slack_client.api_call`
+
+        Arguments:
+            method {str} -- The slack api method, like `chat.postMessage`
+
+        Returns:
+            dict -- The response from the slack api
+        """
+        with self.metrics.timer('api_call', method=method):
+            slack_response = self.web_client.api_call(method, **kwargs)
+
+        if not slack_response.get('ok'):
+            self.metrics.incr('api_errors', method=method, error=slack_response.get('error'))
+
+        return slack_response
+
+    def get_api_url(self):
+        """Url of the slack web api, the one of the `web_client` if it has one (a `SlackWebClient` does)"""
+        return getattr(self.web_client, 'base_url', self.slack_api_url)
+
+    async def async_api_call(self, method, **kwargs):
+        """Call the slack web api without blocking the event loop
+
+        Arguments:
+            method {str} -- The slack api method, like `chat.postMessage`
+
+        Returns:
+            dict -- The response from the slack api
+        """
+        if self.async_client is None:
+            # Only imported when needed since it needs aiohttp
+            from slack_actions.async_client import AsyncSlackClient
+            # Calls from both clients count against the same rate limits
+            self.async_client = AsyncSlackClient(self.SLACK_BOT_TOKEN, base_url=self.get_api_url(),
+                                                 rate_limits=getattr(self.web_client, 'rate_limits', None))
+
+        with self.metrics.timer('api_call', method=method):
+            slack_response = await self.async_client.api_call(method, **kwargs)
+
+        if not slack_response.get('ok'):
+            self.metrics.incr('api_errors', method=method, error=slack_response.get('error'))
+
+        return slack_response
+
+    def _get_event_actions(self, full_data, event_type, field_cache):
+        """Get the actions in the channel that could be triggered by the event
+
+        Arguments:
+            full_data {dict} -- The event from the slack api as well as user and channel data
+            event_type {str} -- Event type of the event that was sent by slack
+            field_cache {dict} -- Fields already pulled out of this event
+
+        Returns:
+            list -- The actions to check, in order
+        """
+        channel_matcher = self._get_channel_matcher(full_data['sa_channel'].get('name', '__direct_message__'),
+                                                    event_type)
+        if channel_matcher is None:
+            # Nothing in the channel is listening for this event_type
+            return ()
+
+        return channel_matcher.candidates(self._get_event_data(full_data), field_cache)
+
+    def _get_event_data(self, full_data):
+        """The part of the event the trigger fields are looked up in"""
+        if full_data['type'] == 'event_callback':
+            return full_data['event']
+
+        return full_data
+
+    def _build_response(self, full_data, callback_output):
+        """Add the defaults to what the callback returned
+
+        Arguments:
+            full_data {dict} -- The event from the slack api as well as user and channel data
+            callback_output {dict} -- What the callback returned
+
+        Returns:
+            dict -- The kwargs for the slack api call
+        """
+        # Default response
+        response = {'channel': full_data['sa_channel']['id'],
+                    'method': 'chat.postMessage',
+                    }
+        response.update(callback_output)
+        return response
+
+    def _log_response_error(self, slack_response):
+        if slack_response['ok'] is False:
+            error_message = "Slack Web API Response: {error} {content} {metadata}"\
+                            .format(error=slack_response['error'],
+                                    content=slack_response.get('needed', ''),
+                                    metadata=slack_response.get('response_metadata', ''))
+            logger.error(error_message)
+
     ###
     # Used to register the triggers
     ###
@@ -384,16 +1060,26 @@ class SlackController:
 
         return self._register_trigger(event_types, args[1], *args[2:], **kwargs)
 
-    def _register_trigger(self, event_types, regex_parsers, *args, flags=0, **kwargs):
+    def _register_trigger(self, event_types, regex_parsers, *args, flags=0, execution=None, batch=None, **kwargs):
+        if execution is not None:
+            CallbackRunner.check_options(execution)
+        if batch is not None:
+            EventBatcher.check_options(batch)
+
         def wrapper(func):
             parse_using = {}
+            fields = []
             for key, regex_str in regex_parsers.items():
                 parse_using[key] = re.compile(regex_str, flags)
+                fields.append((FieldPath(key), parse_using[key]))
 
             for event_type in event_types:
                 self.triggers[event_type][func].append({'pattern': parse_using,
+                                                        'fields': tuple(fields),
                                                         'args': args,
-                                                        'kwargs': kwargs})
+                                                        'kwargs': kwargs,
+                                                        'execution': execution or {},
+                                                        'batch': batch})
                 try:
                     cls_name = func.__self__.__class__.__name__ + '.'
                 except AttributeError:
@@ -404,6 +1090,11 @@ class SlackController:
                                     cls_name=cls_name,
                                     func_name=func.__name__,
                                     parse_using=parse_using))
+
+            self._build_dispatch_table()
+            if (execution or {}).get('executor') == 'process' and self.callback_runner.process_initializer is not None:
+                # Registered after the setup, start the worker processes now instead of on its first event
+                self.callback_runner.warm_process_pool()
             return func
 
         return wrapper
@@ -411,6 +1102,7 @@ class SlackController:
     def help_message(self, **kwargs):
         def wrapper(func):
             self.helpers[func].append(dict(kwargs))
+            self._help_payloads = {}
             try:
                 cls_name = func.__self__.__class__.__name__ + '.'
             except AttributeError:
@@ -422,7 +1114,7 @@ class SlackController:
 
         return wrapper
 
-    def parse_event(self, full_data, callback, triggers):
+    def parse_event(self, full_data, callback, triggers, field_cache=None, event_type=None):
         """Run the callback that matches the trigger
 
         Find the first trigger that matches and run that callback
@@ -432,84 +1124,345 @@ class SlackController:
             callback {function} -- The function to be triggered if a triggered is matched
             triggers {list} -- All the triggers to try and match against
 
+        Keyword Arguments:
+            field_cache {dict} -- Fields already pulled out of this event, shared between calls for the same event
+                                  (default: {None})
+            event_type {str} -- Event type of the event, only used to label the metrics (default: {None})
+
         Returns:
-            dict -- The response to send to the slack api
+            dict -- The response to send to the slack api, `BATCHED` if the event was added to a batch
         """
-        for trigger in triggers:
-            output = {}
-            num_patts = len(trigger['pattern'])
+        trigger, call = self._match_action(full_data, callback, triggers, field_cache=field_cache,
+                                           event_type=event_type)
+        if call is None or call is BATCHED:
+            return call
 
-            for key, regex_pattern in trigger['pattern'].items():
-                key_parts = key.split('.')
-                if full_data['type'] == 'event_callback':
-                    input_str = copy.deepcopy(full_data['event'])
-                else:
-                    input_str = copy.deepcopy(full_data)
+        with self.metrics.timer('callback', event_type=event_type, callback=_callback_name(callback)):
+            return self.callback_runner.run(callback, trigger['execution'], call)
+
+    def _match_action(self, full_data, callback, triggers, field_cache=None, event_type=None, awaitable=False):
+        """Find the trigger of the callback that matches, and either add the event to its batch or get the call
+
+        Used by both `parse_event` and `process_event_async`
+
+        Arguments:
+            full_data {dict} -- The event from the slack api as well as user and channel data
+            callback {function} -- The function to be triggered if a triggered is matched
+            triggers {list} -- All the triggers to try and match against
+
+        Keyword Arguments:
+            field_cache {dict} -- Fields already pulled out of this event (default: {None})
+            event_type {str} -- Event type of the event, only used to label the metrics (default: {None})
+            awaitable {bool} -- The call of an `async def` callback returns its coroutine instead of running it, for
+                                `CallbackRunner.run_async` to await (default: {False})
+
+        Returns:
+            tuple -- The trigger that matched and a function that runs the callback with its arguments.
+                     (None, None) if nothing matched, the call is `BATCHED` if the event was added to a batch
+        """
+        callback_name = _callback_name(callback)
+        with self.metrics.timer('match', event_type=event_type, callback=callback_name):
+            trigger, output = self.match_trigger(full_data, triggers, field_cache=field_cache)
+
+        if trigger is None:
+            self.metrics.incr('trigger_misses', event_type=event_type, callback=callback_name)
+            return None, None
+
+        self.metrics.incr('trigger_matches', event_type=event_type, callback=callback_name)
+        if trigger['batch'] is not None:
+            self.batcher.add(callback, (output, full_data, trigger), **trigger['batch'])
+            return trigger, BATCHED
+
+        is_process = trigger['execution'].get('executor') == 'process'
+        if is_process:
+            # Only send what the callback needs to the worker process
+            full_data = _process_event_data(full_data)
+        args = (output, full_data) + tuple(trigger['args'])
+        if awaitable and not is_process and asyncio.iscoroutinefunction(callback):
+            return trigger, functools.partial(callback, *args, **trigger['kwargs'])
+
+        return trigger, functools.partial(_call_callback, callback, args, trigger['kwargs'])
+
+    def _flush_batch(self, callback, items):
+        """Run a batched callback with the events that matched its triggers
 
-                for part in key_parts:
-                    if isinstance(input_str, list):
-                        # check if current key is an index, if so use it, otherwise default to 0
-                        try:
-                            idx = int(part)
-                            input_str = input_str[idx]
-                            continue  # Move on to the next part
-                        except ValueError:
-                            # Default to the first item and then use the next key
-                            input_str = input_str[0]
+        The callback gets a list of `(output, full_data)` for the events, in the order they were received. What it
+        returns is sent to the channel of the last event, unless it has a `channel`
 
-                    input_str = input_str[part]
+        Arguments:
+            callback {function} -- The callback
+            items {list} -- `(output, full_data, trigger)` of each event
+        """
+        callback_name = _callback_name(callback)
+        # The args and execution options are taken from the trigger of the first event
+        trigger = items[0][2]
+        if trigger['execution'].get('executor') == 'process':
+            events = [(output, _process_event_data(full_data)) for output, full_data, _ in items]
+        else:
+            events = [(output, full_data) for output, full_data, _ in items]
+
+        # batched_events / batches is the average batch size
+        self.metrics.incr('batches', callback=callback_name)
+        self.metrics.incr('batched_events', value=len(events), callback=callback_name)
+        call = functools.partial(_call_callback, callback, (events,) + tuple(trigger['args']), trigger['kwargs'])
+        try:
+            with self.metrics.timer('batch_callback', callback=callback_name):
+                callback_output = self.callback_runner.run(callback, trigger['execution'], call)
+
+            if callback_output is not None:
+                self.send_message(self._build_response(items[-1][1], callback_output), wait=False)
+
+        except Exception:
+            self.metrics.incr('errors', stage='batch', callback=callback_name)
+            logger.exception("Broke running a batch of {} events for {}".format(len(events), callback_name))
+
+    def match_trigger(self, full_data, triggers, field_cache=None):
+        """Find the first trigger that matches the event
+
+        Arguments:
+            full_data {dict} -- The event from the slack api as well as user and channel data
+            triggers {list} -- All the triggers to try and match against
+
+        Keyword Arguments:
+            field_cache {dict} -- Fields already pulled out of this event, shared between calls for the same event
+                                  (default: {None})
+
+        Returns:
+            tuple -- The trigger that matched and the output of its regexes, (None, None) if nothing matched
+        """
+        if field_cache is None:
+            field_cache = {}
+
+        event_data = self._get_event_data(full_data)
+
+        for trigger in triggers:
+            output = {}
+            num_patts = len(trigger['fields'])
+
+            for field, regex_pattern in trigger['fields']:
+                input_str = resolve_field(field, event_data, field_cache)
 
                 # Check the regex agains this field
-                result = re.search(regex_pattern, input_str)
+                result = regex_pattern.search(input_str)
 
                 if result is None:
                     # No match was found, lets move on!
                     break
 
                 if len(result.groupdict().keys()) != 0:
-                    output[key] = result.groupdict()
+                    output[field.key] = result.groupdict()
                 else:
-                    output[key] = result.groups()
+                    output[field.key] = result.groups()
 
-            # All patterns match, fire callback
+            # All patterns match
             if len(output) == num_patts:
-                return callback(output, full_data, *trigger['args'], **trigger['kwargs'])
+                return trigger, output
+
+        return None, None
+
+    def download_file(self, file_info, file_, **kwargs):
+        """Download a file from slack, using the file_cache if it was set in setup()
+
+        Arguments:
+            file_info {dict} -- The file from the slack event or `files.info`
+            file_ {str/file} -- Either a string (filename & path) to save the data to, or an in-memory object
+
+        Keyword Arguments:
+            Same as `download`
 
-    def download(self, url, file_):
+        Returns:
+            str/file/None -- file_, or None if the download failed or was too big
         """
-        file_ is either a string (filename & path) to save the data to, or an in-memory object
+        # The timestamp changes when the file is edited, so the old version is not used
+        version = file_info.get('timestamp', file_info.get('created'))
+        kwargs.setdefault('cache_key', FileCache.cache_key(file_info['id'], version))
+        return self.download(file_info['url_private_download'], file_, **kwargs)
+
+    def download(self, url, file_, max_size=None, chunk_size=DOWNLOAD_CHUNK_SIZE, cache_key=None):
+        """Download a file from slack, streaming it to file_ a chunk at a time
+
+        Arguments:
+            url {str} -- The url of the file, like its `url_private_download`
+            file_ {str/file} -- Either a string (filename & path) to save the data to, or an in-memory object
+
+        Keyword Arguments:
+            max_size {int} -- Do not save files bigger then this many bytes, defaults to the `download_max_size`
+                              passed to setup() (default: {None})
+            chunk_size {int} -- Bytes to read at a time (default: {DOWNLOAD_CHUNK_SIZE})
+            cache_key {str} -- Use the file_cache with this key, see `FileCache.cache_key`. Ignored if there is no
+                               file_cache (default: {None})
+
+        Returns:
+            str/file/None -- file_, or None if the download failed or was too big
         """
+        if max_size is None:
+            max_size = self.download_max_size
+
+        if cache_key is not None and self.file_cache is not None:
+            return self._download_cached(url, file_, max_size, chunk_size, cache_key)
+
         rdata = None
 
         try:
-            request = urllib.request.Request(url)
-            request.add_header('Authorization', 'Bearer {}'.format(self.SLACK_BOT_TOKEN))
-            # urllib downloads files a bit faster then requests does
-            with urllib.request.urlopen(request) as response:
-                data = response.read()
-                if isinstance(file_, str):
-                    # If a file path, then make sure the dirs are created
-                    file_path = os.path.dirname(os.path.abspath(file_))
-                    pathlib.Path(file_path).mkdir(parents=True, exist_ok=True)
+            with self.web_client.stream(url) as response:
+                if response.status_code >= 400:
+                    logger.error("Download Http Error `{}` on {}".format(response.status_code, url))
+                    return None
 
-                    with open(file_, 'wb') as out_file:
-                        out_file.write(data)
+                content_length = int(response.headers.get('Content-Length') or 0)
+                if max_size is not None and content_length > max_size:
+                    raise DownloadTooLargeError("{} is {} bytes, the max is {}".format(url, content_length, max_size))
 
+                chunks = response.iter_content(chunk_size=chunk_size)
+                if isinstance(file_, str):
+                    self._save_to_path(file_, lambda out_file: self._write_chunks(chunks, out_file, max_size, url))
                     rdata = file_
 
                 else:
-                    file_.write(data)
+                    start = file_.tell()
+                    try:
+                        self._write_chunks(chunks, file_, max_size, url)
+                    except BaseException:
+                        # Do not leave part of the file in it
+                        file_.seek(start)
+                        file_.truncate()
+                        raise
+
                     file_.seek(0)
 
                     rdata = file_
 
-        except urllib.error.HTTPError as e:
-            logger.error("Download Http Error `{}` on {}".format(e.code, url))
+        except DownloadTooLargeError as e:
+            logger.error("Download too large: {}".format(e))
 
         except Exception:
             logger.exception("Download Error on {}".format(url))
 
         return rdata
 
+    def _download_cached(self, url, file_, max_size, chunk_size, cache_key):
+        cached_file = self.file_cache.open(cache_key,
+                                           lambda path: self.download(url, path, max_size=max_size,
+                                                                      chunk_size=chunk_size))
+        if cached_file is None:
+            return None
+
+        with cached_file:
+            size = os.fstat(cached_file.fileno()).st_size
+            if max_size is not None and size > max_size:
+                logger.error("Download too large: {} is {} bytes, the max is {}".format(url, size, max_size))
+                return None
+
+            if isinstance(file_, str):
+                self._save_to_path(file_, lambda out_file: shutil.copyfileobj(cached_file, out_file, chunk_size))
+
+            else:
+                shutil.copyfileobj(cached_file, file_, chunk_size)
+                file_.seek(0)
+
+        return file_
+
+    def _save_to_path(self, file_, write):
+        """Write to a temp file next to file_ and then move it into place, so a failed write never leaves part of a
+        file behind
+
+        Arguments:
+            file_ {str} -- Filename & path to save to
+            write {function} -- Takes the temp file and writes the data to it
+        """
+        # Make sure the dirs are created
+        file_path = os.path.dirname(os.path.abspath(file_))
+        pathlib.Path(file_path).mkdir(parents=True, exist_ok=True)
+
+        with tempfile.NamedTemporaryFile(dir=file_path, prefix='.', suffix='.part', delete=False) as out_file:
+            try:
+                write(out_file)
+            except BaseException:
+                out_file.close()
+                os.unlink(out_file.name)
+                raise
+
+        os.replace(out_file.name, file_)
+
+    def _write_chunks(self, chunks, out_file, max_size, url):
+        size = 0
+        for chunk in chunks:
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                raise DownloadTooLargeError("{} is more then the max of {} bytes".format(url, max_size))
+            out_file.write(chunk)
+
+    def download_async(self, url, file_, **kwargs):
+        """Same as `download`, but done in a background thread so the callback is not blocked
+
+        Returns:
+            concurrent.futures.Future -- Resolves to what `download` returns
+        """
+        return self.download_executor.submit(self.download, url, file_, **kwargs)
+
+
+def _call_callback(callback, args, kwargs):
+    callback_output = callback(*args, **kwargs)
+    if inspect.isawaitable(callback_output):
+        loop = slack_controller.event_loop
+        if loop is not None and loop.is_running() and not _in_loop(loop):
+            # An `async def` callback run outside of the asgi app's loop (like a batch), wait on it to run it there.
+            # `asyncio.run` can not be used, this thread may be the one running it
+            callback_output = asyncio.run_coroutine_threadsafe(callback_output, loop).result()
+        else:
+            # An `async def` callback when not running in the asgi app
+            callback_output = asyncio.run(callback_output)
+
+    return callback_output
+
+
+def _in_loop(loop):
+    """Check if the loop is running in the current thread"""
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
+
+
+def _process_event_data(full_data):
+    """Copy of the event that can be sent to a worker process
+
+    The users and channels are looked up now and turned into plain dicts
+
+    Arguments:
+        full_data {dict} -- The event from the slack api as well as user and channel data
+
+    Returns:
+        dict -- The copy
+    """
+    if hasattr(full_data, 'resolve_all'):
+        full_data.resolve_all()
+
+    event_data = dict(full_data)
+    for key in ('sa_user', 'sa_channel'):
+        if isinstance(event_data.get(key), Mapping):
+            event_data[key] = dict(event_data[key])
+
+    return event_data
+
+
+def _init_process_worker(slack_bot_token, slack_api_url, download_max_size):
+    """Set up the slack_controller in a worker process, so callbacks can call the slack api and download files
+
+    The worker is started from a forkserver, so `setup()` never ran in it. Only what the callbacks need is set up:
+    messages are sent directly and files are downloaded without the file cache (the parent process keeps track of
+    what is in it)
+    """
+    slack_controller.SLACK_BOT_TOKEN = slack_bot_token
+    slack_controller.web_client = SlackWebClient(slack_bot_token, base_url=slack_api_url)
+    slack_controller.download_max_size = download_max_size
+    slack_controller.outbound = None
+    slack_controller.event_queue = None
+    slack_controller.capture = None
+    slack_controller.file_cache = None
+    slack_controller.download_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='slack-actions-download')
+    slack_controller.lookup_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='slack-actions-lookup')
+    slack_controller.callback_runner = CallbackRunner(metrics=slack_controller.metrics)
+
 
 slack_controller = SlackController()
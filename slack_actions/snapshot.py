@@ -0,0 +1,72 @@
+import json
+import time
+import zlib
+import logging
+import pathlib
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+
+class DirectorySnapshot:
+    """Saves the users and channels to a sqlite file so a new worker can start without waiting on the slack api
+
+    Each directory is saved as a single zlib compressed json blob of its records
+    """
+
+    def __init__(self, path):
+        """
+        Arguments:
+            path {str} -- Path of the sqlite file, it is created if it does not exist
+        """
+        self.path = path
+        pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS directories '
+                         '(name TEXT PRIMARY KEY, saved_at REAL NOT NULL, data BLOB NOT NULL)')
+
+    def _connect(self):
+        # A new connection each time so it can be used from any thread
+        return sqlite3.connect(self.path, timeout=30)
+
+    def load(self, name):
+        """Load the records of a directory
+
+        Arguments:
+            name {str} -- Name of the directory (`users` or `channels`)
+
+        Returns:
+            dict/None -- The records accessible by name and id, None if it has not been saved yet
+        """
+        try:
+            with self._connect() as conn:
+                row = conn.execute('SELECT saved_at, data FROM directories WHERE name = ?', (name,)).fetchone()
+        except sqlite3.Error:
+            logger.exception("Failed to load the {} snapshot from {}".format(name, self.path))
+            return None
+
+        if row is None:
+            return None
+
+        saved_at, data = row
+        records = {}
+        for record in json.loads(zlib.decompress(data).decode('utf-8')):
+            if record.get('name') is not None:
+                records[record['name']] = record
+            records[record['id']] = record
+
+        logger.info("Loaded {num} {name} from the snapshot saved {age:.0f}s ago"
+                    .format(num=len(records), name=name, age=time.time() - saved_at))
+        return records
+
+    def save(self, name, records):
+        """Save the records of a directory, replacing what was saved before
+
+        Arguments:
+            name {str} -- Name of the directory (`users` or `channels`)
+            records {list} -- The records to save, each one only once
+        """
+        data = zlib.compress(json.dumps([dict(record) for record in records], separators=(',', ':')).encode('utf-8'))
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO directories (name, saved_at, data) VALUES (?, ?, ?)',
+                         (name, time.time(), data))
@@ -0,0 +1,220 @@
+"""Get the events from slack over a websocket (Socket Mode) instead of slack posting them to `/slack/event`
+
+No public url is needed, which makes it easy to run behind a firewall. It needs an app level token (`xapp-...`) with
+the `connections:write` scope and Socket Mode turned on in the settings of the slack app.
+See https://api.slack.com/apis/connections/socket
+"""
+import json
+import time
+import random
+import logging
+import threading
+
+import requests
+import websocket
+
+from slack_actions.api import event as event_resource
+from slack_actions.event_queue import EventQueue
+from slack_actions.slack_controller import slack_controller
+
+logger = logging.getLogger(__name__)
+
+# Envelope types that have an event in the same format as the ones posted to `/slack/event`
+ENVELOPE_TYPES = {'events_api', 'interactive'}
+
+
+class SocketModeClient:
+    """Keeps a single websocket connection to slack open and processes the events sent over it
+
+    Each envelope is acknowledged as soon as it is received, then processed by the `event_queue` of the setup (or
+    its own workers if there is none). When the connection drops it reconnects, waiting longer after each connection
+    that did not stay up for `stable_after` seconds
+    """
+
+    def __init__(self, app_token, num_workers=4, ping_interval=10, min_backoff=1, max_backoff=60, stable_after=30,
+                 url=None):
+        """
+        Arguments:
+            app_token {str} -- The app level token (`xapp-...`)
+
+        Keyword Arguments:
+            num_workers {int} -- Threads processing the events if the setup has no `event_workers` (default: {4})
+            ping_interval {float} -- Seconds without anything from slack before sending a ping, the connection is
+                                     dropped if there is still nothing after the same time again (default: {10})
+            min_backoff {float} -- Least seconds to wait before reconnecting, even right after a good connection
+                                   (default: {1})
+            max_backoff {float} -- Most seconds to wait between reconnects (default: {60})
+            stable_after {float} -- Seconds a connection has to stay up before the wait goes back to `min_backoff`
+                                    (default: {30})
+            url {str} -- Connect to this websocket url instead of asking slack for one, for testing (default: {None})
+        """
+        self.app_token = app_token
+        self.num_workers = num_workers
+        self.ping_interval = ping_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after
+        self.url = url
+
+        self.connections = 0  # Times it connected
+        self.envelopes = 0  # Envelopes received
+        self.connected = threading.Event()
+        self._event_queue = None
+        self._ws = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Connect in a background thread, does nothing if it is already running"""
+        if self._thread is not None:
+            return
+
+        if slack_controller.event_queue is None:
+            self._event_queue = EventQueue(num_workers=self.num_workers)
+            self._event_queue.start()
+
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='slack-actions-socket-mode', daemon=True)
+        self._thread.start()
+
+    def stop(self, wait=True):
+        """Close the connection and stop reconnecting
+
+        Keyword Arguments:
+            wait {bool} -- Block until the thread has exited and the events already received are processed
+                           (default: {True})
+        """
+        self._stopping.set()
+        ws = self._ws
+        if ws is not None:
+            # Wakes up the thread waiting on the websocket
+            ws.abort()
+
+        if wait and self._thread is not None:
+            self._thread.join()
+        self._thread = None
+
+        if self._event_queue is not None:
+            self._event_queue.stop(wait=wait)
+            self._event_queue = None
+
+    def get_url(self):
+        """Ask slack for the url of the websocket, each url can only be used once
+
+        Returns:
+            str -- The websocket url
+        """
+        if self.url is not None:
+            return self.url
+
+        response = requests.post(slack_controller.get_api_url() + 'apps.connections.open',
+                                 headers={'Authorization': 'Bearer {}'.format(self.app_token)},
+                                 timeout=10)
+        slack_response = response.json()
+        if not slack_response.get('ok'):
+            raise ConnectionError("apps.connections.open failed: {}".format(slack_response.get('error')))
+
+        return slack_response['url']
+
+    def _run(self):
+        backoff = self.min_backoff
+        while not self._stopping.is_set():
+            connected_at = None
+            try:
+                self._ws = websocket.create_connection(self.get_url(), timeout=self.ping_interval)
+                self.connections += 1
+                connected_at = time.monotonic()
+                self._receive_loop()
+
+            except Exception as e:
+                if self._stopping.is_set():
+                    break
+                logger.warning("Socket Mode connection failed: {}".format(e))
+
+            finally:
+                self.connected.clear()
+                if self._ws is not None:
+                    try:
+                        self._ws.close()
+                    except Exception:
+                        pass
+                    self._ws = None
+
+            if connected_at is not None and time.monotonic() - connected_at >= self.stable_after:
+                # It was working before it dropped (or slack asked to reconnect). Not a failure
+                backoff = self.min_backoff
+
+            # Always wait a bit, a server that closes the connection right after the hello would otherwise have it
+            # calling `apps.connections.open` in a tight loop. Jitter so all the workers do not reconnect at once
+            self._stopping.wait(backoff * random.uniform(1, 1.5))
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def _receive_loop(self):
+        """Read from the websocket until it is closed, or slack asks to reconnect"""
+        last_received = time.monotonic()
+        while not self._stopping.is_set():
+            try:
+                opcode, data = self._ws.recv_data(control_frame=True)
+            except websocket.WebSocketTimeoutException:
+                if time.monotonic() - last_received > self.ping_interval * 2:
+                    logger.warning("Nothing from slack in {}s, reconnecting".format(self.ping_interval * 2))
+                    return
+                self._ws.ping()
+                continue
+
+            last_received = time.monotonic()
+            if opcode == websocket.ABNF.OPCODE_CLOSE:
+                return
+
+            if opcode != websocket.ABNF.OPCODE_TEXT:
+                # Pings and pongs
+                continue
+
+            message = json.loads(data.decode('utf-8'))
+            if message.get('type') == 'hello':
+                self.connected.set()
+                logger.info("Connected to slack with Socket Mode")
+
+            elif message.get('type') == 'disconnect':
+                # Slack refreshes the connection every few hours, it sends this first
+                logger.info("Slack asked to reconnect: {}".format(message.get('reason')))
+                return
+
+            elif message.get('envelope_id'):
+                self._ack(message['envelope_id'])
+                self._handle_envelope(message)
+
+    def _ack(self, envelope_id):
+        self._ws.send(json.dumps({'envelope_id': envelope_id}))
+
+    def _handle_envelope(self, envelope):
+        """Process the event in an envelope the same way as one posted to `/slack/event`
+
+        Arguments:
+            envelope {dict} -- The message from slack, the event is its `payload`
+        """
+        self.envelopes += 1
+        if envelope.get('type') not in ENVELOPE_TYPES:
+            logger.debug("Skipping Socket Mode envelope of type {}".format(envelope.get('type')))
+            return
+
+        body = json.dumps(envelope['payload']).encode('utf-8')
+        retry_num = envelope.get('retry_attempt') or None
+        if slack_controller.capture is not None:
+            headers = {}
+            if retry_num is not None:
+                headers['X-Slack-Retry-Num'] = str(retry_num)
+            slack_controller.capture.record(body, headers)
+
+        with slack_controller.metrics.timer('decode'):
+            event = event_resource.parse_body(body)
+
+        if slack_controller.deduplicator is not None:
+            if not slack_controller.deduplicator.check(event, retry_num=retry_num,
+                                                       retry_reason=envelope.get('retry_reason')):
+                return
+
+        event_queue = slack_controller.event_queue or self._event_queue
+        if not event_queue.submit(event_resource.handle_event, event):
+            logger.warning("Event queue is full, processing the event before reading the next one")
+            event_resource.handle_event(event)
@@ -0,0 +1,98 @@
+"""Helpers to run slack_actions without slack, used by the replay tool and the benchmarks
+
+    from slack_actions.testing import StubWebClient
+    slack_controller.setup(slack_bot_token='xoxb-test', web_client=StubWebClient(users=[...], channels=[...]))
+"""
+import time
+import threading
+
+
+class StubWebClient:
+    """Stands in for `SlackWebClient`, answering the slack web api methods slack_actions uses without calling slack
+
+    Users and channels that it was not given are made up from their id the first time they are asked for, unless
+    `make_up_missing` is False. Anything that is not a lookup (like `chat.postMessage`) just returns `ok`
+    """
+
+    base_url = 'http://stub-slack/api/'
+
+    def __init__(self, users=None, channels=None, latency=0, make_up_missing=True, bot_user_id='USTUBBOT',
+                 file_channel=None):
+        """
+        Keyword Arguments:
+            users {list} -- The users in the workspace (default: {None})
+            channels {list} -- The channels in the workspace (default: {None})
+            latency {float} -- Seconds each call takes, to act more like the real api (default: {0})
+            make_up_missing {bool} -- Answer `users.info`/`conversations.info` for ids it was not given, instead of
+                                      a `user_not_found`/`channel_not_found` error (default: {True})
+            bot_user_id {str} -- User id of the bot, added to the users if it is not in them (default: {'USTUBBOT'})
+            file_channel {str} -- Channel every file is in for `files.info`, defaults to the first channel
+                                  (default: {None})
+        """
+        self.latency = latency
+        self.make_up_missing = make_up_missing
+        self.bot_user_id = bot_user_id
+        self.users = {user['id']: user for user in users or []}
+        self.channels = {channel['id']: channel for channel in channels or []}
+        self.users.setdefault(bot_user_id, {'id': bot_user_id, 'name': 'stub-bot', 'is_bot': True,
+                                            'profile': {'bot_id': 'B' + bot_user_id[1:]}})
+        if file_channel is None:
+            file_channel = next(iter(self.channels), 'CSTUB')
+        self.file_channel = file_channel
+
+        self.calls = {}  # method -> number of calls
+        self.total_calls = 0
+        self._lock = threading.Lock()
+
+    def api_call(self, method, **kwargs):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.total_calls += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if method == 'auth.test':
+            return {'ok': True, 'user_id': self.bot_user_id}
+
+        if method == 'users.list':
+            return self._page(list(self.users.values()), 'members', kwargs)
+
+        if method == 'conversations.list':
+            return self._page(list(self.channels.values()), 'channels', kwargs)
+
+        if method == 'users.info':
+            user = self.users.get(kwargs['user'])
+            if user is None and self.make_up_missing:
+                user = {'id': kwargs['user'], 'name': kwargs['user'].lower(), 'profile': {}}
+            if user is None:
+                return {'ok': False, 'error': 'user_not_found'}
+            return {'ok': True, 'user': user}
+
+        if method == 'conversations.info':
+            channel = self.channels.get(kwargs['channel'])
+            if channel is None and self.make_up_missing:
+                channel = {'id': kwargs['channel'], 'name': kwargs['channel'].lower()}
+            if channel is None:
+                return {'ok': False, 'error': 'channel_not_found'}
+            return {'ok': True, 'channel': channel}
+
+        if method == 'files.info':
+            return {'ok': True, 'file': {'id': kwargs['file'], 'channels': [self.file_channel]}}
+
+        return {'ok': True, 'ts': '{:.6f}'.format(time.time())}
+
+    def _page(self, records, key, kwargs):
+        start = int(kwargs.get('cursor') or 0)
+        end = start + kwargs.get('limit', 1000)
+        next_cursor = str(end) if end < len(records) else ''
+        return {'ok': True, key: records[start:end], 'response_metadata': {'next_cursor': next_cursor}}
+
+    def stats(self):
+        """Number of calls to each method
+
+        Returns:
+            dict -- method -> calls
+        """
+        with self._lock:
+            return dict(self.calls)
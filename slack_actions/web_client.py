@@ -0,0 +1,316 @@
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Calls per minute allowed for each of slacks rate limit tiers https://api.slack.com/docs/rate-limits
+TIER_RATES = {1: 1,
+              2: 20,
+              3: 50,
+              4: 100,
+              }
+
+# Tier of the methods used the most, anything not in here is treated as tier 3
+METHOD_TIERS = {'auth.test': 4,
+                'conversations.info': 3,
+                'conversations.list': 2,
+                'files.info': 4,
+                'files.upload': 2,
+                'users.info': 4,
+                'users.list': 2,
+                'chat.delete': 3,
+                'chat.postEphemeral': 4,
+                'chat.update': 3,
+                'reactions.add': 3,
+                }
+
+# Methods that are limited per channel instead of per tier. Calls per minute for each channel
+PER_CHANNEL_RATES = {'chat.postMessage': 60,
+                     }
+
+
+class TokenBucket:
+    """Rate limiter that allows short bursts
+
+    Tokens are added at a steady rate up to `burst`, each call takes one and waits if there are none
+    """
+
+    def __init__(self, rate_per_minute, burst=None):
+        """
+        Arguments:
+            rate_per_minute {int} -- How many calls are allowed per minute
+
+        Keyword Arguments:
+            burst {int} -- Max number of calls that can be made at once, defaults to a tenth of the rate
+                           (default: {None})
+        """
+        self.rate = rate_per_minute / 60.0  # Tokens per second
+        self.burst = burst or max(1, rate_per_minute // 10)
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def _try_take(self):
+        """Take a token if there is one
+
+        Returns:
+            float -- 0 if a token was taken, otherwise the seconds to wait before trying again
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            if now >= self._paused_until and self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+
+            return max(self._paused_until - now, (1 - self._tokens) / self.rate)
+
+    def acquire(self):
+        """Take a token, waiting until there is one
+
+        Returns:
+            float -- Seconds spent waiting
+        """
+        waited = 0
+        while True:
+            wait = self._try_take()
+            if not wait:
+                return waited
+
+            time.sleep(wait)
+            waited += wait
+
+    async def acquire_async(self):
+        """Same as `acquire`, but waits without blocking the event loop"""
+        waited = 0
+        while True:
+            wait = self._try_take()
+            if not wait:
+                return waited
+
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds):
+        """Do not give out any tokens for a while, used when slack says to retry after some time
+
+        The tokens are left alone, so the call can be retried as soon as the pause is over
+
+        Arguments:
+            seconds {float} -- How long to pause for
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class RateLimits:
+    """The token buckets and stats of the calls to each method
+
+    Shared by `SlackWebClient` and `AsyncSlackClient` so calls made by either count against the same limits
+    """
+
+    def __init__(self, max_channel_buckets=1000):
+        """
+        Keyword Arguments:
+            max_channel_buckets {int} -- Max number of channels to keep a bucket for (for `chat.postMessage`), the
+                                         least recently used are dropped first (default: {1000})
+        """
+        self.max_channel_buckets = max_channel_buckets
+        self._buckets = {}  # method -> TokenBucket
+        self._channel_buckets = OrderedDict()  # (method, channel) -> TokenBucket, least recently used first
+        self._buckets_lock = threading.Lock()
+        self._stats = defaultdict(lambda: {'calls': 0,
+                                           'errors': 0,
+                                           'rate_limited': 0,
+                                           'throttled_seconds': 0.0,
+                                           'total_seconds': 0.0,
+                                           'max_seconds': 0.0,
+                                           })
+        self._stats_lock = threading.Lock()
+
+    def get_bucket(self, method, kwargs):
+        """Get the token bucket of the call
+
+        Arguments:
+            method {str} -- The slack api method
+            kwargs {dict} -- The arguments of the call, the channel is used by the methods limited per channel
+
+        Returns:
+            TokenBucket -- The bucket
+        """
+        if method in PER_CHANNEL_RATES:
+            # A bot can post to any number of channels, only keep the buckets of the ones used recently
+            key = (method, kwargs.get('channel'))
+            with self._buckets_lock:
+                bucket = self._channel_buckets.get(key)
+                if bucket is None:
+                    bucket = self._channel_buckets[key] = TokenBucket(PER_CHANNEL_RATES[method])
+                    while len(self._channel_buckets) > self.max_channel_buckets:
+                        self._channel_buckets.popitem(last=False)
+                else:
+                    self._channel_buckets.move_to_end(key)
+            return bucket
+
+        bucket = self._buckets.get(method)
+        if bucket is None:
+            with self._buckets_lock:
+                bucket = self._buckets.setdefault(method, TokenBucket(TIER_RATES[METHOD_TIERS.get(method, 3)]))
+
+        return bucket
+
+    def rate_limited(self, method, bucket, headers):
+        """Slack responded with a 429, pause the bucket for as long as it said
+
+        Arguments:
+            method {str} -- The slack api method
+            bucket {TokenBucket} -- The bucket of the call
+            headers {dict} -- Headers of the response
+        """
+        retry_after = float(headers.get('Retry-After', 1))
+        logger.warning("Rate limited by slack on {method}, retrying in {retry_after}s"
+                       .format(method=method, retry_after=retry_after))
+        self.record(method, rate_limited=1)
+        # Everything else using the same limit needs to wait too
+        bucket.pause(retry_after)
+
+    def record(self, method, calls=0, errors=0, rate_limited=0, throttled_seconds=0.0, elapsed=None):
+        with self._stats_lock:
+            method_stats = self._stats[method]
+            method_stats['calls'] += calls
+            method_stats['errors'] += errors
+            method_stats['rate_limited'] += rate_limited
+            method_stats['throttled_seconds'] += throttled_seconds
+            if elapsed is not None:
+                method_stats['total_seconds'] += elapsed
+                method_stats['max_seconds'] = max(method_stats['max_seconds'], elapsed)
+
+    def stats(self):
+        with self._stats_lock:
+            return {method: dict(method_stats) for method, method_stats in self._stats.items()}
+
+
+def encode_api_data(kwargs):
+    """Encode the arguments of a call the same as the slackclient, nested data (like attachments) is sent as json
+
+    Arguments:
+        kwargs {dict} -- The arguments of the call
+
+    Returns:
+        dict -- The form data to post
+    """
+    data = {}
+    for key, value in kwargs.items():
+        if value is None:
+            continue
+        if isinstance(value, (dict, list, tuple)):
+            value = json.dumps(value)
+        elif isinstance(value, bool):
+            value = 'true' if value else 'false'
+        data[key] = value
+
+    return data
+
+
+class SlackWebClient:
+    """Calls the slack web api, keeping connections alive and staying under slacks rate limits
+
+    Calls are delayed by a token bucket per method (and per channel for `chat.postMessage`).
+    If slack still responds with a 429, the call waits for the `Retry-After` time and is sent again.
+    """
+
+    def __init__(self, token, base_url='https://slack.com/api/', pool_size=10, max_retries=5, timeout=30):
+        """
+        Arguments:
+            token {str} -- The slack bot token
+
+        Keyword Arguments:
+            base_url {str} -- Url of the slack web api, can be changed to point to a test server
+                              (default: {'https://slack.com/api/'})
+            pool_size {int} -- Max number of connections to keep open (default: {10})
+            max_retries {int} -- Max number of times to retry a call that was rate limited (default: {5})
+            timeout {int} -- Seconds to wait on a response from slack (default: {30})
+        """
+        self.token = token
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = 'Bearer {}'.format(token)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.rate_limits = RateLimits()
+
+    def api_call(self, method, files=None, **kwargs):
+        """Call a slack web api method
+
+        Same as `SlackClient.api_call`
+
+        Arguments:
+            method {str} -- The slack api method, like `chat.postMessage`
+
+        Keyword Arguments:
+            files {dict} -- Files to upload, passed to requests (default: {None})
+
+        Returns:
+            dict -- The response from the slack api
+        """
+        data = encode_api_data(kwargs)
+        bucket = self.rate_limits.get_bucket(method, kwargs)
+        throttled_seconds = 0
+        start_time = time.monotonic()
+        for _ in range(self.max_retries + 1):
+            throttled_seconds += bucket.acquire()
+            response = self.session.post(self.base_url + method, data=data, files=files, timeout=self.timeout)
+
+            if response.status_code != 429:
+                break
+
+            self.rate_limits.rate_limited(method, bucket, response.headers)
+
+        try:
+            slack_response = response.json()
+        except ValueError:
+            # Rate limited too many times or some other http error
+            slack_response = {'ok': False, 'error': 'http_{}'.format(response.status_code)}
+
+        elapsed = time.monotonic() - start_time
+        self.rate_limits.record(method, calls=1, errors=0 if slack_response.get('ok') else 1,
+                                throttled_seconds=throttled_seconds, elapsed=elapsed)
+        return slack_response
+
+    def stream(self, url):
+        """Start a GET request to a slack url (like a file's `url_private_download`) without reading the body
+
+        Uses the same pooled connections as the api calls
+
+        Arguments:
+            url {str} -- The url to get
+
+        Returns:
+            requests.Response -- Use it as a context manager so the connection goes back to the pool,
+                                 read the body with `iter_content`
+        """
+        return self.session.get(url, stream=True, timeout=self.timeout)
+
+    def stats(self):
+        """Counts and timings of the calls made to each method
+
+        `throttled_seconds` is the time spent waiting on the rate limits,
+        `total_seconds`/`max_seconds` are the time the calls took including that waiting
+
+        Returns:
+            dict -- method -> stats
+        """
+        return self.rate_limits.stats()
@@ -0,0 +1,53 @@
+import json
+import time
+import asyncio
+
+import pytest
+
+falcon_testing = pytest.importorskip('falcon.testing')
+pytest.importorskip('falcon.asgi')
+
+from slack_actions.asgi import app as asgi_app  # noqa: E402
+from slack_actions.slack_controller import slack_controller  # noqa: E402
+from slack_actions.testing import StubWebClient  # noqa: E402
+
+
+def message_event(text, event_id):
+    return {'type': 'event_callback',
+            'event_id': event_id,
+            'event': {'type': 'message', 'text': text, 'channel': 'C1', 'user': 'U1', 'ts': '1.0'},
+            }
+
+
+def test_async_batched_callback_reaching_max_size():
+    batches = []
+
+    @slack_controller.trigger(['message'], {'text': '^abatch (.+)'}, batch={'max_size': 2, 'max_wait': 60})
+    async def abatch(events):
+        await asyncio.sleep(0)
+        # Run on the loop of the asgi app, not a new one
+        batches.append((asyncio.get_running_loop() is slack_controller.event_loop,
+                        [output['text'][0] for output, _ in events]))
+        return {'text': 'got {}'.format(len(events))}
+
+    web_client = StubWebClient(users=[{'id': 'U1', 'name': 'alice'}], channels=[{'id': 'C1', 'name': 'general'}])
+    slack_controller.setup(slack_bot_token='xoxb-test', web_client=web_client)
+    slack_controller.add_commands({'__all__': [abatch]})
+
+    async def post_events():
+        # A single loop for all the requests, like a real asgi server
+        async with falcon_testing.ASGIConductor(asgi_app) as conductor:
+            for idx in range(2):
+                body = json.dumps(message_event('abatch {}'.format(idx), 'Ev{}'.format(idx)))
+                response = await conductor.simulate_post('/slack/event', body=body)
+                assert response.status_code == 200
+
+            # Flushed by the batcher's thread, the request that filled the batch does not wait on it
+            deadline = time.monotonic() + 5
+            while not web_client.calls.get('chat.postMessage') and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+
+    asyncio.run(post_events())
+
+    assert batches == [(True, ['0', '1'])]
+    assert web_client.calls.get('chat.postMessage') == 1